@@ -0,0 +1,362 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import gc
+import statistics
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql import migration  # noqa: E402
+from sql.aggs import List  # noqa: E402
+from sql.cache import statements  # noqa: E402
+from sql.field import Field  # noqa: E402
+from sql.model import Model, ModelManager  # noqa: E402
+from sql.query import Q  # noqa: E402
+from sql.select import Select  # noqa: E402
+
+
+class User(Model):
+    name = Field()
+    email = Field(unique=True)
+    age = Field(column_type='integer')
+    data = Field(column_type='jsonb')
+    created = Field(column_type='timestamp')
+
+
+class Post(Model):
+    user_id = Field(column_type='integer')
+    title = Field()
+    body = Field()
+    rating = Field(column_type='integer')
+
+
+class Comment(Model):
+    post_id = Field(column_type='integer')
+    user_id = Field(column_type='integer')
+    text = Field()
+
+
+# Workloads: each returns a callable that builds and compiles one query
+
+def wide_select():
+    def run():
+        return list(Select(
+            User.id, User.name, User.email, User.age,
+            profile={
+                'name': User.name,
+                'email': User.email,
+                'meta': {
+                    'age': User.age,
+                    'created': User.created,
+                    'kind': User.data['kind'],
+                    'tags': {'a': User.data['a'], 'b': User.data['b'], 'c': 1},
+                },
+            },
+            stats={f'k{i}': User.data[f'k{i}'] for i in range(20)},
+        ).filter(User.age > 18))
+    return run
+
+
+def wide_json():
+    def run():
+        return list(Select(
+            User.id,
+            profile={f'k{i}': User.data[f'k{i}'] if i % 2 else i for i in range(200)},
+        ))
+    return run
+
+
+def in_list():
+    def run():
+        ids = range(1000)
+        condition = Q(f'"user"."id" IN ({", ".join("{}" for _ in ids)})', *ids)
+        return list(Select(User.id).filter(condition))
+    return run
+
+
+def and_chain(size=100):
+    def run():
+        condition = User.id > 0
+        for i in range(size):
+            condition = condition & (User.age != i)
+        return list(Select(User.id).filter(condition))
+    return run
+
+
+def or_chain(size=100):
+    def run():
+        condition = User.id == 0
+        for i in range(size):
+            condition = condition | (User.name == str(i))
+        return list(Select(User.id).filter(condition))
+    return run
+
+
+def long_chain(size):
+    # Build time must grow linearly with the number of predicates
+    run = and_chain(size)
+    run.statement_cache = False
+    return run
+
+
+def query_memory(predicates=40):
+    def run():
+        condition = User.id > 0
+        for i in range(predicates):
+            condition = condition & ((User.age != i) | User.name.contains(str(i)))
+        return Select(User.id, User.name, User.email).filter(condition)
+
+    run.measure = measure_memory
+    run.statement_cache = False
+    return run
+
+
+def aliased_joins():
+    def run():
+        select = Select(User.id, User.name)
+        for i in range(10):
+            post = Post[f'p{i}']
+            select.values(**{f'title{i}': post.title})
+            select.join(post, (post.user_id == User.id) & (post.rating > i))
+        return list(select)
+    return run
+
+
+def list_aggregates():
+    def run():
+        return list(Select(
+            User.id,
+            posts=List(id=Post.id, title=Post.title, rating=Post.rating),
+            comments=List(id=Comment.id, text=Comment.text, meta={'post': Comment.post_id}),
+        ).join(Post, Post.user_id == User.id).join(
+            Comment, Comment.user_id == User.id
+        ).group(User.id))
+    return run
+
+
+def migration_diff(tables=200, columns=20, migrations=1, replay=False):
+    directory = tempfile.mkdtemp()
+    package = f'bench_migrations_{migrations}_{int(replay)}'
+    path = os.path.join(directory, package)
+    os.makedirs(path)
+
+    def get_last_migration():
+        return os.path.splitext(sorted(
+            name for name in os.listdir(path) if name.endswith('.py')
+        )[~0])[0]
+
+    # Tables are spread over `migrations` files
+    models = []
+    last_migration = None
+    for i in range(tables):
+        attrs = {f'c{j}': Field(column_type='integer' if j % 2 else 'text') for j in range(columns)}
+        attrs['Meta'] = type('Meta', (), {'table_name': f'bench_{i}'})
+        models.append(ModelManager(f'Bench{i}', (Model, ), attrs))
+
+        if (i + 1) % (tables // migrations) == 0 or i == tables - 1:
+            with chdir(directory):
+                migration.create_migrations(package, last_migration)
+            last_migration = get_last_migration()
+
+    def run():
+        if replay:
+            # Without snapshots every migration module is imported and applied
+            for name in os.listdir(path):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(path, name))
+            for name in [name for name in sys.modules if name.startswith(f'{package}.')]:
+                del sys.modules[name]
+
+        with chdir(directory):
+            migration.create_migrations(package, last_migration)
+
+    sys.path.insert(0, directory)
+
+    def cleanup():
+        sys.path.remove(directory)
+        for model in models:
+            ModelManager.models.discard(model)
+
+    run.cleanup = cleanup
+    run.statement_cache = False
+    return run
+
+
+WORKLOADS = {
+    'wide_select': wide_select,
+    'wide_json_200': wide_json,
+    'in_list_1000': in_list,
+    'and_chain_100': and_chain,
+    'or_chain_100': or_chain,
+    'and_chain_1000': lambda: long_chain(1000),
+    'and_chain_4000': lambda: long_chain(4000),
+    'and_chain_10000': lambda: long_chain(10000),
+    'aliased_joins_10': aliased_joins,
+    'list_aggregates': list_aggregates,
+    'query_memory_40': query_memory,
+    'migration_diff_200x20': migration_diff,
+    'migration_snapshot_100_files': lambda: migration_diff(migrations=100),
+    'migration_replay_100_files': lambda: migration_diff(migrations=100, replay=True),
+}
+
+
+@contextmanager
+def chdir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+@contextmanager
+def statement_cache(enabled):
+    maxsize = statements.maxsize
+    statements.clear()
+    if not enabled:
+        statements.maxsize = 0
+    try:
+        yield
+    finally:
+        statements.maxsize = maxsize
+        statements.clear()
+
+
+def measure(run, rounds, min_time):
+    # Calibrate the number of calls per round to last at least min_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        timings.append((time.perf_counter() - start) / number * 1e6)
+
+    return {
+        'min_us': min(timings),
+        'median_us': statistics.median(timings),
+        'mean_us': statistics.mean(timings),
+        'stdev_us': statistics.stdev(timings) if len(timings) > 1 else 0,
+        'rounds': rounds,
+        'calls_per_round': number,
+    }
+
+
+def measure_memory(run, rounds, min_time, number=100):
+    # Bytes still allocated per built query, the results are kept alive
+    run()
+    gc.collect()
+
+    sizes = []
+    for _ in range(rounds):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        results = [run() for _ in range(number)]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        sizes.append(sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / number)
+        del results
+
+    return {
+        'bytes': statistics.median(sizes),
+        'rounds': rounds,
+        'calls_per_round': number,
+    }
+
+
+def format_result(result):
+    if 'bytes' in result:
+        return f'{result["bytes"]:>10.0f}B '
+    return f'{result["median_us"]:>10.1f}us'
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f'{"benchmark":<40} {"baseline":>12} {"current":>12} {"ratio":>8}')
+    for name, result in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        key = 'bytes' if 'bytes' in result else 'median_us'
+        ratio = result[key] / previous[key]
+        print(
+            f'{name:<40} {format_result(previous)} '
+            f'{format_result(result)} {ratio:>7.2f}x'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query build benchmarks')
+    parser.add_argument('-o', '--output', help='Save results to a JSON file')
+    parser.add_argument('-c', '--compare', help='Compare with a saved JSON file')
+    parser.add_argument('-k', '--filter', default='', help='Only run matching benchmarks')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.05)
+    options = parser.parse_args()
+
+    results = {}
+    for name, workload in WORKLOADS.items():
+        if options.filter not in name:
+            continue
+
+        run = workload()
+        try:
+            if getattr(run, 'statement_cache', True):
+                variants = {f'{name}[uncached]': False, f'{name}[cached]': True}
+            else:
+                variants = {name: False}
+
+            for key, cached in variants.items():
+                with statement_cache(cached):
+                    results[key] = getattr(run, 'measure', measure)(
+                        run, options.rounds, options.min_time
+                    )
+                print(f'{key:<40} {format_result(results[key])}')
+        finally:
+            getattr(run, 'cleanup', lambda: None)()
+
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    if options.output:
+        with open(options.output, 'w') as fo:
+            json.dump(report, fo, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as fo:
+            compare(results, json.load(fo))
+
+
+if __name__ == '__main__':
+    main()
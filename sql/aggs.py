@@ -3,6 +3,7 @@ from sql.mixins import SelectValuesMixin
 
 
 class List(SelectValuesMixin, Q):
+    __slots__ = ('_fields', )
 
     def __init__(self, *args, **kwargs):
         self.dependencies = set()
@@ -12,3 +13,7 @@ class List(SelectValuesMixin, Q):
 
     def compile(self, args):
         return f'JSON_AGG({self._json_build_object_recursive(self._fields, args)})'
+
+    def collect(self, shape, args):
+        shape.append(List)
+        self._collect_recursive(self._fields, shape, args)
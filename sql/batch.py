@@ -0,0 +1,50 @@
+import json
+
+from sql import executor
+from sql.query import renumber
+from sql.select import Select
+
+
+class Batch:
+    # Independent queries as columns of one statement: a single round-trip,
+    # one shared args list
+
+    def __init__(self, *statements):
+        # Selects return their rows, other statements (count(), exists(),
+        # as_list()...) their single value
+        self.statements = [
+            statement if isinstance(statement, Select) else tuple(statement)
+            for statement in statements
+        ]
+
+    def __iter__(self):
+        args = []
+        columns = []
+
+        for i, statement in enumerate(self.statements):
+            if isinstance(statement, Select):
+                # Compiled straight into the shared args, no renumbering
+                sql = statement._compile_json(statement.compile(args))
+            else:
+                sql, *statement_args = statement
+                sql = renumber(sql, len(args))
+                args.extend(statement_args)
+            columns.append(f'({sql}) "q{i}"')
+
+        yield f'SELECT {", ".join(columns)}'
+        yield from args
+
+    def split(self, row):
+        results = []
+        for i, statement in enumerate(self.statements):
+            value = row[i]
+            if isinstance(statement, Select):
+                if isinstance(value, str):
+                    value = json.loads(value)
+                value = value or []
+            results.append(value)
+        return results
+
+    async def fetch(self, pool=None, timeout=None):
+        rows = await executor.get_pool(pool).fetch(self, timeout=timeout)
+        return self.split(rows[0])
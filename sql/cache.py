@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+
+
+class StatementCache:
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()
+        # Statements are built from any thread, move_to_end and popitem
+        # would race on the shared order
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def get(self, shape):
+        with self._lock:
+            try:
+                sql = self._statements[shape]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._statements.move_to_end(shape)
+            self.hits += 1
+            return sql
+
+    def set(self, shape, sql):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._statements[shape] = sql
+            self._statements.move_to_end(shape)
+
+            while len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._statements),
+            'maxsize': self.maxsize,
+        }
+
+
+statements = StatementCache()
@@ -0,0 +1,228 @@
+import json
+import struct
+import datetime
+from functools import partial
+
+from sql.field import SERIAL_TYPES
+from sql.mixins import WriteMixin
+
+BINARY_SIGNATURE = b'PGCOPY\n\377\r\n\0'
+BINARY_HEADER = BINARY_SIGNATURE + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+
+POSTGRES_EPOCH = datetime.datetime(2000, 1, 1)
+POSTGRES_EPOCH_TZ = POSTGRES_EPOCH.replace(tzinfo=datetime.timezone.utc)
+POSTGRES_EPOCH_DATE = POSTGRES_EPOCH.date()
+
+# Marker for columns missing from a dict row
+MISSING = object()
+
+TEXT_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+})
+
+
+def _get_base_type(column_type):
+    column_type = column_type.lower().split('(')[0].strip()
+    return SERIAL_TYPES.get(column_type, column_type)
+
+
+# Text format
+
+def _encode_array_item(value):
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, (list, tuple)):
+        return _encode_array(value)
+
+    value = _encode_text_value(value, '')
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _encode_array(value):
+    return '{' + ','.join(_encode_array_item(item) for item in value) + '}'
+
+
+def _encode_text_value(value, column_type):
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    elif column_type.endswith('[]') and isinstance(value, (list, tuple)):
+        return _encode_array(value)
+    elif isinstance(value, (dict, list, tuple)):
+        return json.dumps(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    else:
+        return str(value)
+
+
+def _encode_text_row(row, column_types):
+    values = []
+    for value, column_type in zip(row, column_types):
+        if value is None:
+            values.append('\\N')
+        else:
+            values.append(
+                _encode_text_value(value, column_type).translate(TEXT_ESCAPES)
+            )
+    return ('\t'.join(values) + '\n').encode()
+
+
+# Binary format
+
+def _encode_struct(fmt):
+    return lambda value: struct.pack(fmt, value)
+
+
+def _encode_str(value):
+    if not isinstance(value, str):
+        value = json.dumps(value)
+    return value.encode()
+
+
+def _encode_jsonb(value):
+    return b'\x01' + _encode_str(value)
+
+
+def _encode_uuid(value):
+    return value.bytes if hasattr(value, 'bytes') else bytes.fromhex(value.replace('-', ''))
+
+
+def _encode_date(value):
+    return struct.pack('!i', (value - POSTGRES_EPOCH_DATE).days)
+
+
+def _encode_timestamp(value):
+    delta = value - (POSTGRES_EPOCH_TZ if value.tzinfo else POSTGRES_EPOCH)
+    return struct.pack('!q', delta // datetime.timedelta(microseconds=1))
+
+
+BINARY_ENCODERS = {
+    'smallint': _encode_struct('!h'),
+    'int2': _encode_struct('!h'),
+    'integer': _encode_struct('!i'),
+    'int': _encode_struct('!i'),
+    'int4': _encode_struct('!i'),
+    'bigint': _encode_struct('!q'),
+    'int8': _encode_struct('!q'),
+    'real': _encode_struct('!f'),
+    'float4': _encode_struct('!f'),
+    'double precision': _encode_struct('!d'),
+    'float8': _encode_struct('!d'),
+    'boolean': lambda value: b'\x01' if value else b'\x00',
+    'bool': lambda value: b'\x01' if value else b'\x00',
+    'text': _encode_str,
+    'varchar': _encode_str,
+    'character varying': _encode_str,
+    'char': _encode_str,
+    'json': _encode_str,
+    'jsonb': _encode_jsonb,
+    'bytea': bytes,
+    'uuid': _encode_uuid,
+    'date': _encode_date,
+    'timestamp': _encode_timestamp,
+    'timestamptz': _encode_timestamp,
+    'timestamp with time zone': _encode_timestamp,
+    'timestamp without time zone': _encode_timestamp,
+}
+
+
+def get_binary_encoder(column_type):
+    try:
+        return BINARY_ENCODERS[_get_base_type(column_type)]
+    except KeyError:
+        raise Exception(f'Binary copy does not support {column_type} columns')
+
+
+def _encode_binary_row(row, encoders):
+    chunks = [struct.pack('!h', len(encoders))]
+    for value, encoder in zip(row, encoders):
+        if value is None:
+            chunks.append(struct.pack('!i', -1))
+        else:
+            value = encoder(value)
+            chunks.append(struct.pack('!i', len(value)))
+            chunks.append(value)
+    return b''.join(chunks)
+
+
+class Copy(WriteMixin):
+
+    def __init__(self, table, rows, columns=None, binary=False, batch_size=1000):
+        self.table = table
+        self.rows = rows
+        self.binary = binary
+        self.batch_size = batch_size
+
+        if columns is None:
+            self.columns = [
+                (name, field)
+                for name, field in table.Meta.fields.items()
+                if not field.primary
+            ]
+        else:
+            self.columns = [self._get_field(column) for column in columns]
+
+    def statement(self):
+        names = ', '.join(f'"{field.name}"' for _, field in self.columns)
+        sql = f'COPY "{self.table.Meta.table_name}" ({names}) FROM STDIN'
+        if self.binary:
+            sql += ' WITH (FORMAT binary)'
+        return sql
+
+    def _iter_rows(self):
+        names = [name for name, _ in self.columns]
+        # Dict keys may be attribute or column names
+        positions = {}
+        for i, (name, field) in enumerate(self.columns):
+            positions[name] = positions[field.name] = i
+
+        for row in self.rows:
+            if isinstance(row, dict):
+                values = [MISSING] * len(names)
+                for key, value in row.items():
+                    if key not in positions:
+                        raise Exception(f'Unknown column {key} for {self.table}')
+                    values[positions[key]] = value
+                missing = [name for name, value in zip(names, values) if value is MISSING]
+                if missing:
+                    # COPY has no DEFAULT, NULL would silently replace it
+                    raise Exception(f'Row {row} has no value for {missing}')
+                yield values
+            elif len(row) != len(names):
+                # Binary rows declare their field count, a short row would
+                # corrupt the stream
+                raise Exception(f'Row {row} does not match columns {self.columns}')
+            else:
+                yield row
+
+    def __iter__(self):
+        if self.binary:
+            encoders = [get_binary_encoder(field.column_type) for _, field in self.columns]
+            encode_row = partial(_encode_binary_row, encoders=encoders)
+            yield BINARY_HEADER
+        else:
+            column_types = [field.column_type.lower() for _, field in self.columns]
+            encode_row = partial(_encode_text_row, column_types=column_types)
+
+        batch = []
+        for row in self._iter_rows():
+            batch.append(encode_row(row))
+            if len(batch) >= self.batch_size:
+                yield b''.join(batch)
+                batch = []
+
+        if batch:
+            yield b''.join(batch)
+
+        if self.binary:
+            yield BINARY_TRAILER
+
+    def write(self, fo):
+        for chunk in self:
+            fo.write(chunk)
@@ -0,0 +1,29 @@
+class Cursor:
+
+    def __init__(self, select, batch_size=1000, name='select_cursor'):
+        self.select = select
+        self.batch_size = batch_size
+        self.name = name
+
+    def declare(self):
+        sql, *args = self.select
+        return (f'DECLARE "{self.name}" NO SCROLL CURSOR FOR {sql}', *args)
+
+    def fetch(self):
+        return (f'FETCH FORWARD {self.batch_size} FROM "{self.name}"', )
+
+    def close(self):
+        return (f'CLOSE "{self.name}"', )
+
+    def iterate(self, connection):
+        # Sync drivers: the caller owns the surrounding transaction
+        connection.execute(*self.declare())
+        try:
+            while True:
+                rows = connection.fetch(*self.fetch())
+                if rows:
+                    yield rows
+                if len(rows) < self.batch_size:
+                    break
+        finally:
+            connection.execute(*self.close())
@@ -0,0 +1,62 @@
+from sql.query import Q
+from sql.mixins import WriteMixin
+
+
+class Delete(WriteMixin):
+
+    def __init__(self, table):
+        self.table = table
+
+        self._sources = []
+        self._filters = []
+        self._returning = {}
+
+    def using(self, *tables):
+        # USING lists exactly these tables, a subquery in a condition keeps
+        # its own FROM
+        self._sources.extend(tables)
+        return self
+
+    def filter(self, *conditions):
+        self._filters.extend(conditions)
+        return self
+
+    def keys(self, values, key='id'):
+        # Key set bound as one array, so the statement text doesn't depend
+        # on the number of keys
+        _, field = self._get_field(key)
+        return self.filter(field.any(values))
+
+    def _compile_using(self):
+        return ', '.join(str(table) for table in self._sources)
+
+    def _compile_filters(self, args):
+        filters = []
+        for condition in self._filters:
+            if isinstance(condition, Q):
+                filters.append(condition.compile(args))
+        return ' AND '.join(filters)
+
+    def compile(self, args):
+        sql = [f'DELETE FROM {self._compile_table()}']
+
+        using = self._compile_using()
+        if using:
+            sql.append('USING')
+            sql.append(using)
+
+        filters = self._compile_filters(args)
+        if filters:
+            sql.append('WHERE')
+            sql.append(filters)
+
+        sql.extend(self._compile_returning(args))
+
+        return ' '.join(sql)
+
+    # Finalize methods
+
+    def __iter__(self):
+        args = []
+        yield self.compile(args)
+        yield from args
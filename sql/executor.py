@@ -0,0 +1,212 @@
+import asyncio
+from time import perf_counter
+from contextlib import asynccontextmanager, aclosing
+from typing import Protocol
+
+from sql import migration, profile, results
+from sql.mixins import WriteMixin
+
+_pool = None
+
+
+class Connection(Protocol):
+    # asyncpg connections already match everything except copy()
+
+    async def fetch(self, sql, *args):
+        ...
+
+    async def fetchval(self, sql, *args):
+        ...
+
+    async def execute(self, sql, *args):
+        ...
+
+    async def copy(self, sql, chunks):
+        ...
+
+    async def close(self):
+        ...
+
+
+class Pool:
+
+    def __init__(self, connect, size=10, timeout=None):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._semaphore:
+            connection = self._idle.pop() if self._idle else await self.connect()
+            try:
+                yield connection
+            except BaseException:
+                # Connection state is unknown after a failed or cancelled query
+                await connection.close()
+                raise
+            else:
+                self._idle.append(connection)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+
+    def _get_timeout(self, timeout):
+        return self.timeout if timeout is None else timeout
+
+    async def _run(self, method, statement, timeout):
+        sql, *args = statement
+        async with self.acquire() as connection:
+            profiler = profile.profiler
+            if profiler is not None:
+                start = perf_counter()
+
+            result = await asyncio.wait_for(
+                getattr(connection, method)(sql, *args),
+                self._get_timeout(timeout),
+            )
+
+            if profiler is not None:
+                profiler.record_execution(sql, perf_counter() - start)
+
+            _invalidate(statement)
+
+            return result
+
+    async def fetch(self, statement, timeout=None):
+        return await self._run('fetch', statement, timeout)
+
+    async def fetchval(self, statement, timeout=None):
+        return await self._run('fetchval', statement, timeout)
+
+    async def execute(self, statement, timeout=None):
+        return await self._run('execute', statement, timeout)
+
+    async def copy(self, copy, timeout=None):
+        async with self.acquire() as connection:
+            result = await asyncio.wait_for(
+                connection.copy(copy.statement(), iter(copy)),
+                self._get_timeout(timeout),
+            )
+            _invalidate(copy)
+            return result
+
+    async def stream(self, cursor, timeout=None):
+        timeout = self._get_timeout(timeout)
+
+        async with self.acquire() as connection:
+            # Cursors only live inside a transaction
+            await connection.execute('BEGIN')
+            try:
+                await asyncio.wait_for(connection.execute(*cursor.declare()), timeout)
+                while True:
+                    rows = await asyncio.wait_for(connection.fetch(*cursor.fetch()), timeout)
+                    if rows:
+                        yield rows
+                    if len(rows) < cursor.batch_size:
+                        break
+            except GeneratorExit:
+                # Consumer stopped early, connection is still usable
+                await connection.execute(*cursor.close())
+                await connection.execute('COMMIT')
+            except BaseException:
+                await connection.execute('ROLLBACK')
+                raise
+            else:
+                await connection.execute(*cursor.close())
+                await connection.execute('COMMIT')
+
+    async def backfill(self, backfill, last_id=None, timeout=None):
+        rows = await self.fetch(backfill.bounds(), timeout=timeout)
+        min_id, max_id = rows[0][0], rows[0][1]
+
+        for statement, progress in backfill.batches(min_id, max_id, last_id):
+            await self.execute(statement, timeout=timeout)
+            results.invalidate(backfill.conf['table_name'])
+            yield progress
+
+            if backfill.sleep and not progress['done']:
+                # Throttle, so replicas and autovacuum can keep up
+                await asyncio.sleep(backfill.sleep)
+
+    async def migrate(self, migrations_module_path, last_migration=None, resume=None,
+                      timeout=None):
+        # `resume` is the last progress yielded by an interrupted run
+        for migration_item, operations in migration.migrate(migrations_module_path, last_migration):
+            start, last_id = 0, None
+            if resume and resume['migration'] == migration_item:
+                start = resume['operation'] + (1 if resume['done'] else 0)
+                # A finished operation's last_id must not leak into the next one
+                last_id = None if resume['done'] else resume.get('last_id')
+
+            for i, operation in enumerate(operations):
+                if i < start:
+                    continue
+
+                progress = {'migration': migration_item, 'operation': i}
+
+                if isinstance(operation, migration.Backfill):
+                    batches = self.backfill(
+                        operation, last_id if i == start else None, timeout
+                    )
+                    async with aclosing(batches):
+                        async for batch_progress in batches:
+                            yield dict(progress, **batch_progress)
+                else:
+                    async with self.acquire() as connection:
+                        for sql in operation.statements():
+                            await asyncio.wait_for(
+                                connection.execute(sql), self._get_timeout(timeout)
+                            )
+                    yield dict(progress, done=True)
+
+    async def pipeline(self, *statements, method='fetch', timeout=None):
+        compiled = [tuple(statement) for statement in statements]
+
+        async with self.acquire() as connection:
+            if hasattr(connection, 'pipeline'):
+                # Driver can send all statements before reading the results
+                run = connection.pipeline(compiled, method)
+            else:
+                run = _run_sequentially(connection, compiled, method)
+
+            result = await asyncio.wait_for(run, self._get_timeout(timeout))
+
+        for statement in statements:
+            _invalidate(statement)
+
+        return result
+
+
+def _invalidate(statement):
+    # Cached results of every query reading the written table are dropped
+    if isinstance(statement, WriteMixin):
+        results.invalidate(statement.table)
+
+
+async def _run_sequentially(connection, statements, method):
+    results = []
+    for sql, *args in statements:
+        results.append(await getattr(connection, method)(sql, *args))
+    return results
+
+
+def configure(pool):
+    global _pool
+    _pool = pool
+    return pool
+
+
+def get_pool(pool=None):
+    if pool is not None:
+        return pool
+
+    if _pool is None:
+        raise Exception('Pool is not configured, call sql.executor.configure() first')
+
+    return _pool
@@ -1,19 +1,30 @@
-from sql.query import Q
+from sql.query import Q, EMPTY_DEPENDENCIES
+
+SERIAL_TYPES = {
+    'smallserial': 'smallint',
+    'serial': 'integer',
+    'bigserial': 'bigint',
+}
 
 
 class Field(Q):
-    name = None
-    table = None
+    __slots__ = (
+        'column_type', 'name', 'table', 'default', 'nullable', 'unique',
+        'primary', 'index', 'help', 'verbose_name',
+    )
 
     def __init__(self, name=None, column_type='text', default=None, nullable=True,
-                 unique=False, primary=False,
+                 unique=False, primary=False, index=False,
                  help='', verbose_name=''):
         self.column_type = column_type
         self.name = name
+        self.table = None
+        self.dependencies = EMPTY_DEPENDENCIES
         self.default = default
         self.nullable = nullable
         self.unique = unique
         self.primary = primary
+        self.index = index
         self.help = help
         self.verbose_name = verbose_name
 
@@ -29,8 +40,16 @@ class Field(Q):
         else:
             return super().__repr__()
 
+    @property
+    def array_type(self):
+        column_type = SERIAL_TYPES.get(self.column_type.lower(), self.column_type)
+        return f'{column_type}[]'
+
     def compile_constraint(self, args):
         return ''
 
     def compile(self, args):
         return str(self)
+
+    def collect(self, shape, args):
+        shape.append(str(self))
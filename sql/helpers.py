@@ -1,4 +1,47 @@
+import json
+import uuid
+import base64
+import decimal
+import datetime
+
+
 def timeout(stmt, timeout):
     iterator = iter(stmt)
     yield f'SET statement_timeout = {timeout};{next(iterator)};SET statement_timeout = DEFAULT;'
     yield from iterator
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    elif isinstance(value, decimal.Decimal):
+        return {'decimal': str(value)}
+    elif isinstance(value, uuid.UUID):
+        return {'uuid': str(value)}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        (value_type, value), = value.items()
+        if value_type == 'datetime':
+            return datetime.datetime.fromisoformat(value)
+        elif value_type == 'date':
+            return datetime.date.fromisoformat(value)
+        elif value_type == 'decimal':
+            return decimal.Decimal(value)
+        elif value_type == 'uuid':
+            return uuid.UUID(value)
+    return value
+
+
+def encode_cursor(values):
+    data = json.dumps([_encode_cursor_value(value) for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    return tuple(_decode_cursor_value(value) for value in json.loads(data))
@@ -0,0 +1,108 @@
+import hashlib
+
+from sql.query import Q, F, inline
+from sql.field import Field
+
+# Shortcuts for trigram indexes used by contains/icontains/regex lookups,
+# they require the pg_trgm extension
+METHODS = {
+    'gin_trgm': ('gin', 'gin_trgm_ops'),
+    'gist_trgm': ('gist', 'gist_trgm_ops'),
+}
+
+
+def compile_literal(value):
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    elif isinstance(value, (int, float)):
+        return str(value)
+    else:
+        value = str(value).replace("'", "''")
+        return f"'{value}'"
+
+
+def compile_expression(expression):
+    # DDL can't have bound parameters, so values are inlined as literals
+    if isinstance(expression, (F, str)):
+        return str(expression)
+
+    args = []
+    query = expression.compile(args)
+    return inline(query, args, compile_literal)
+
+
+class Index:
+
+    def __init__(self, *expressions, name=None, method='btree', where=None,
+                 unique=False, opclass=None):
+        self.expressions = expressions
+        self.name = name
+        self.method, self.opclass = METHODS.get(method, (method, opclass))
+        self.where = where
+        self.unique = unique
+
+        if opclass is not None:
+            self.opclass = opclass
+
+    def _resolve(self, model, value):
+        if callable(value) and not isinstance(value, Q):
+            value = value(model)
+
+        if isinstance(value, str):
+            for name, field in model.Meta.fields.items():
+                if value in (name, field.name):
+                    return field
+            raise Exception(f'Unknown column {value} for {model}')
+
+        return value
+
+    def get_structure(self, model):
+        table_name = model.Meta.table_name
+
+        columns = []
+        names = []
+        simple = True
+
+        for expression in self.expressions:
+            expression = self._resolve(model, expression)
+
+            if isinstance(expression, Field):
+                column = f'"{expression.name}"'
+                names.append(expression.name)
+            else:
+                column = f'({compile_expression(expression)})'
+                names.append('expr')
+                simple = False
+
+            if self.opclass:
+                column = f'{column} {self.opclass}'
+
+            columns.append(column)
+
+        where = None
+        if self.where is not None:
+            where_expression = self.where
+            if callable(where_expression) and not isinstance(where_expression, Q):
+                where_expression = where_expression(model)
+            where = compile_expression(where_expression)
+            simple = False
+
+        structure = {
+            'columns': columns,
+            'method': self.method,
+            'unique': self.unique,
+            'where': where,
+        }
+
+        name = self.name
+        if name is None:
+            # Postgres truncates identifiers to 63 bytes
+            name = f'{table_name}_{"_".join(names)}'[:50]
+            if not simple:
+                digest = hashlib.md5(repr(sorted(structure.items())).encode()).hexdigest()
+                name = f'{name}_{digest[:8]}'
+            name = f'{name}_idx'
+
+        return name, structure
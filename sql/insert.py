@@ -0,0 +1,210 @@
+from sql.query import Q, placeholder
+from sql.mixins import WriteMixin
+
+# PostgreSQL wire protocol limit of bound parameters per statement
+MAX_PARAMETERS = 32767
+
+# Marker for columns missing from a dict row
+DEFAULT = object()
+
+
+class Insert(WriteMixin):
+
+    def __init__(self, table, *rows, columns=None):
+        self.table = table
+
+        self._rows = []
+        self._columns = None
+        self._returning = {}
+        self._conflict = None
+        self._unnest = False
+
+        if columns is not None:
+            self._columns = [self._get_field(column) for column in columns]
+
+        self.values(*rows)
+
+    def values(self, *rows):
+        self._rows.extend(rows)
+        return self
+
+    def on_conflict(self, *fields, update=None, where=None):
+        self._conflict = fields, update, where
+        return self
+
+    def unnest(self):
+        self._unnest = True
+        return self
+
+    def _get_columns(self):
+        if self._columns is not None:
+            return self._columns
+
+        if self._rows and isinstance(self._rows[0], dict):
+            names = set()
+            for row in self._rows:
+                names.update(row)
+            columns = [self._get_field(name) for name in names]
+            order = list(self.table.Meta.fields)
+            return sorted(columns, key=lambda column: order.index(column[0]))
+
+        return [
+            (name, field)
+            for name, field in self.table.Meta.fields.items()
+            if not field.primary
+        ]
+
+    def _get_row(self, row, names):
+        # Dict keys may be attribute or column names, values are read by
+        # attribute name. `names` caches the lookup across rows
+        values = {}
+        for key, value in row.items():
+            name = names.get(key)
+            if name is None:
+                name = names[key] = self._get_field(key)[0]
+            values[name] = value
+        return values
+
+    def _compile_row(self, row, columns, args, names):
+        if isinstance(row, dict):
+            row = self._get_row(row, names)
+            row = [row.get(name, DEFAULT) for name, _ in columns]
+        elif len(row) != len(columns):
+            raise Exception(f'Row {row} does not match columns {columns}')
+
+        values = []
+        for value in row:
+            if value is DEFAULT:
+                values.append('DEFAULT')
+            elif isinstance(value, Q):
+                values.append(value.compile(args))
+            else:
+                values.append(placeholder(args, value))
+
+        return f'({", ".join(values)})'
+
+    def _compile_unnest(self, rows, columns, args):
+        arrays = [[] for _ in columns]
+        names = {}
+
+        for row in rows:
+            if isinstance(row, dict):
+                row = self._get_row(row, names)
+                missing = [name for name, _ in columns if name not in row]
+                if missing:
+                    # Arrays can't carry DEFAULT, NULL would silently replace it
+                    raise Exception(f'Row {row} has no value for {missing} in unnest mode')
+                row = [row[name] for name, _ in columns]
+            elif len(row) != len(columns):
+                raise Exception(f'Row {row} does not match columns {columns}')
+
+            for array, value in zip(arrays, row):
+                if isinstance(value, Q):
+                    raise Exception('Expressions are not supported in unnest mode')
+                array.append(value)
+
+        unnest = []
+        for array, (_, field) in zip(arrays, columns):
+            unnest.append(f'{placeholder(args, array)}::{field.array_type}')
+
+        return f'SELECT * FROM UNNEST({", ".join(unnest)})'
+
+    def _compile_conflict(self, columns, args):
+        if self._conflict is None:
+            return []
+
+        fields, update, where = self._conflict
+
+        sql = ['ON CONFLICT']
+
+        if fields:
+            targets = ', '.join(f'"{self._get_field(field)[1].name}"' for field in fields)
+            sql.append(f'({targets})')
+
+        if where is not None:
+            sql.append('WHERE')
+            sql.append(where.compile(args))
+
+        if not update:
+            sql.append('DO NOTHING')
+            return sql
+
+        if update is True:
+            conflict_names = {self._get_field(field)[0] for field in fields}
+            update = [name for name, _ in columns if name not in conflict_names]
+            if not update:
+                # Every inserted column is a conflict target, nothing to set
+                sql.append('DO NOTHING')
+                return sql
+
+        sets = []
+        if isinstance(update, dict):
+            for column, value in update.items():
+                column_name = self._get_field(column)[1].name
+                if isinstance(value, Q):
+                    sets.append(f'"{column_name}" = {value.compile(args)}')
+                else:
+                    sets.append(f'"{column_name}" = {placeholder(args, value)}')
+        else:
+            for column in update:
+                column_name = self._get_field(column)[1].name
+                sets.append(f'"{column_name}" = EXCLUDED."{column_name}"')
+
+        sql.append('DO UPDATE SET')
+        sql.append(', '.join(sets))
+
+        return sql
+
+    def compile(self, args, rows=None):
+        columns = self._get_columns()
+        rows = self._rows if rows is None else rows
+
+        if not rows:
+            raise Exception('Nothing to insert')
+
+        names = ', '.join(f'"{field.name}"' for _, field in columns)
+
+        sql = [f'INSERT INTO {self._compile_table()} ({names})']
+
+        if self._unnest:
+            sql.append(self._compile_unnest(rows, columns, args))
+        else:
+            names = {}
+            sql.append('VALUES')
+            sql.append(', '.join(
+                self._compile_row(row, columns, args, names) for row in rows
+            ))
+
+        sql.extend(self._compile_conflict(columns, args))
+        sql.extend(self._compile_returning(args))
+
+        return ' '.join(sql)
+
+    def _chunk_size(self):
+        if self._unnest:
+            return max(len(self._rows), 1)
+
+        args = []
+        columns = self._get_columns()
+        self._compile_conflict(columns, args)
+        self._compile_returning(args)
+
+        return max((MAX_PARAMETERS - len(args)) // max(len(columns), 1), 1)
+
+    # Finalize methods
+
+    def chunks(self):
+        size = self._chunk_size()
+        for start in range(0, len(self._rows), size):
+            args = []
+            sql = self.compile(args, self._rows[start:start + size])
+            yield (sql, *args)
+
+    def __iter__(self):
+        if len(self._rows) > self._chunk_size():
+            raise Exception('Too many rows for one statement, use chunks()')
+
+        args = []
+        yield self.compile(args)
+        yield from args
+
@@ -2,14 +2,35 @@ import os
 import pydoc
 import json
 import uuid
+import hashlib
 
+from sql.index import Index
 from sql.model import ModelManager
-from sql.query import F
+from sql.query import Q, F, placeholder
 
 _structures = {}
 
+ACCESS_EXCLUSIVE = 'ACCESS EXCLUSIVE'
+SHARE_UPDATE_EXCLUSIVE = 'SHARE UPDATE EXCLUSIVE'
+SHARE_ROW_EXCLUSIVE = 'SHARE ROW EXCLUSIVE'
+ROW_EXCLUSIVE = 'ROW EXCLUSIVE'
+
+# Weakest first
+LOCKS = (ROW_EXCLUSIVE, SHARE_UPDATE_EXCLUSIVE, SHARE_ROW_EXCLUSIVE, ACCESS_EXCLUSIVE)
+
+ONLINE_LOCK_TIMEOUT = '5s'
+
+# Online steps that build indexes concurrently run after the column changes
+INDEX_PHASE = 5
+
 
 class Operation:
+    # Operations that can't run inside a transaction block have to be
+    # executed on their own by the caller of migrate()
+    transaction = True
+    # Strongest lock taken on the table, and whether the table is rewritten
+    lock = ACCESS_EXCLUSIVE
+    rewrite = False
 
     def __init__(self, conf):
         self.conf = conf
@@ -20,34 +41,61 @@ class Operation:
     def compile(self):
         raise NotImplemented
 
+    def statements(self):
+        sql = self.compile()
+
+        lock_timeout = self.conf.get('lock_timeout')
+        if lock_timeout is None:
+            return [sql]
+
+        # Fail fast instead of queueing every other query behind the lock
+        return [
+            f"SET lock_timeout = '{lock_timeout}'",
+            sql,
+            'SET lock_timeout = DEFAULT',
+        ]
 
-class AddColumn(Operation):
+
+class TableOperation(Operation):
+    # Compiles to ALTER TABLE actions, which AlterTable can merge into
+    # one statement
+
+    def actions(self):
+        raise NotImplemented
+
+    def compile(self):
+        table_name = self.conf['table_name']
+        return f'ALTER TABLE "{table_name}" {", ".join(self.actions())}'
+
+
+class AddColumn(TableOperation):
 
     def apply(self):
         table_name = self.conf['table_name']
         columns = _structures[table_name]['columns']
         columns[self.conf['column_name']] = self.conf['column']
 
-    def compile(self):
-        table_name = self.conf['table_name']
+    def actions(self):
         column_sql = _get_column_sql(self.conf['column_name'], self.conf['column'])
-        return f'ALTER TABLE "{table_name}" ADD COLUMN {column_sql}'
+        return [f'ADD COLUMN {column_sql}']
 
 
-class DeleteColumn(Operation):
+class DeleteColumn(TableOperation):
 
     def apply(self):
         table_name = self.conf['table_name']
         columns = _structures[table_name]['columns']
         del columns[self.conf['column_name']]
 
-    def compile(self):
-        table_name = self.conf['table_name']
-        column_name = self.conf['column_name']
-        return f'ALTER TABLE "{table_name}" DROP COLUMN "{column_name}"'
+    def actions(self):
+        return [f'DROP COLUMN "{self.conf["column_name"]}"']
 
 
-class AlterColumn(Operation):
+class AlterColumn(TableOperation):
+
+    @property
+    def rewrite(self):
+        return 'column_type' in self.conf['changes']
 
     def apply(self):
         table_name = self.conf['table_name']
@@ -57,7 +105,7 @@ class AlterColumn(Operation):
         columns = _structures[table_name]['columns']
         columns[column_name] = column
 
-    def compile(self):
+    def actions(self):
         table_name = self.conf['table_name']
         column_name = self.conf['column_name']
         column = self.conf['column']
@@ -88,7 +136,12 @@ class AlterColumn(Operation):
             elif change == 'unique':
                 unique_constraint_name = f'{table_name}_{column_name}_key'
 
-                if column['unique']:
+                if column['unique'] and self.conf.get('using_index'):
+                    alters.append(
+                        f'ADD CONSTRAINT "{unique_constraint_name}" '
+                        f'UNIQUE USING INDEX "{unique_constraint_name}"'
+                    )
+                elif column['unique']:
                     alters.append(f'ADD UNIQUE ("{column_name}")')
                 else:
                     alters.append(f'DROP CONSTRAINT "{unique_constraint_name}"')
@@ -99,7 +152,7 @@ class AlterColumn(Operation):
                 else:
                     alters.append(f'{alter_column_prefix} SET DEFAULT {column["default"]}')
 
-        return f'ALTER TABLE "{table_name}" {", ".join(alters)}'
+        return alters
 
 
 class CreateTable(Operation):
@@ -125,7 +178,329 @@ class CreateTable(Operation):
         return ''.join(sql)
 
 
-def _get_operations_diff(structure):
+class CreateIndex(Operation):
+    transaction = False
+    lock = SHARE_UPDATE_EXCLUSIVE
+
+    def apply(self):
+        if self.conf.get('constraint'):
+            # Index is attached to a unique constraint right after
+            return
+
+        table = _structures[self.conf['table_name']]
+        table.setdefault('indexes', {})[self.conf['name']] = self.conf['index']
+
+    def compile(self):
+        table_name = self.conf['table_name']
+        name = self.conf['name']
+        index = self.conf['index']
+
+        unique = 'UNIQUE ' if index['unique'] else ''
+        sql = (
+            f'CREATE {unique}INDEX CONCURRENTLY "{name}" ON "{table_name}" '
+            f'USING {index["method"]} ({", ".join(index["columns"])})'
+        )
+
+        if index['where']:
+            sql += f' WHERE {index["where"]}'
+
+        return sql
+
+
+class DropIndex(Operation):
+    transaction = False
+    lock = SHARE_UPDATE_EXCLUSIVE
+
+    def apply(self):
+        table = _structures[self.conf['table_name']]
+        del table['indexes'][self.conf['name']]
+
+    def compile(self):
+        return f'DROP INDEX CONCURRENTLY IF EXISTS "{self.conf["name"]}"'
+
+
+class AddConstraint(TableOperation):
+
+    def apply(self):
+        pass
+
+    def actions(self):
+        name = self.conf['name']
+
+        action = f'ADD CONSTRAINT "{name}" CHECK ({self.conf["check"]})'
+        if self.conf.get('not_valid'):
+            # Only checks new rows, existing ones are checked by ValidateConstraint
+            action += ' NOT VALID'
+        return [action]
+
+
+class ValidateConstraint(TableOperation):
+    lock = SHARE_UPDATE_EXCLUSIVE
+
+    def apply(self):
+        pass
+
+    def actions(self):
+        return [f'VALIDATE CONSTRAINT "{self.conf["name"]}"']
+
+
+class DropConstraint(TableOperation):
+
+    def apply(self):
+        pass
+
+    def actions(self):
+        return [f'DROP CONSTRAINT IF EXISTS "{self.conf["name"]}"']
+
+
+# Operations AlterTable merges. DropConstraint stays on its own: within one
+# ALTER TABLE drops run first, so the CHECK that lets SET NOT NULL skip
+# the table scan would be gone before it
+ALTER_OPERATIONS = {
+    operation_class.__name__: operation_class
+    for operation_class in (AddColumn, DeleteColumn, AlterColumn, AddConstraint)
+}
+
+
+class AlterTable(TableOperation):
+    # Several actions in one statement: the lock is taken once, and
+    # Postgres rewrites the table at most once for all of them
+
+    def _get_operations(self):
+        return [
+            ALTER_OPERATIONS[operation_name](conf)
+            for operation_name, conf in self.conf['operations']
+        ]
+
+    @property
+    def lock(self):
+        return max(
+            (operation.lock for operation in self._get_operations()),
+            key=LOCKS.index,
+        )
+
+    @property
+    def rewrite(self):
+        return any(operation.rewrite for operation in self._get_operations())
+
+    def apply(self):
+        for operation in self._get_operations():
+            operation.apply()
+
+    def actions(self):
+        actions = []
+        for operation in self._get_operations():
+            actions += operation.actions()
+        return actions
+
+
+class Backfill(Operation):
+    # Data migration: populates columns in keyset batches of `batch_size`
+    # rows, so no single UPDATE holds row locks on the whole table
+    lock = ROW_EXCLUSIVE
+
+    def apply(self):
+        pass
+
+    @property
+    def key(self):
+        return self.conf.get('key', 'id')
+
+    @property
+    def batch_size(self):
+        return self.conf.get('batch_size', 1000)
+
+    @property
+    def sleep(self):
+        return self.conf.get('sleep', 0)
+
+    def bounds(self):
+        table_name = self.conf['table_name']
+        return (f'SELECT MIN("{self.key}"), MAX("{self.key}") FROM "{table_name}"', )
+
+    def _compile(self, args):
+        table_name = self.conf['table_name']
+
+        values = []
+        for column_name, value in self.conf['values'].items():
+            if isinstance(value, Q):
+                # Parentheses make a Select value a valid scalar subquery
+                values.append(f'"{column_name}" = ({value.compile(args)})')
+            else:
+                values.append(f'"{column_name}" = {placeholder(args, value)}')
+
+        # Batch range is always bound to $1 and $2
+        sql = [
+            f'UPDATE "{table_name}" SET {", ".join(values)}',
+            f'WHERE "{table_name}"."{self.key}" > $1 AND "{table_name}"."{self.key}" <= $2',
+        ]
+
+        where = self.conf.get('where')
+        if where is not None:
+            sql.append(f'AND ({where.compile(args)})')
+
+        return ' '.join(sql)
+
+    def compile(self):
+        return self._compile([None, None])
+
+    def batches(self, min_id, max_id, last_id=None):
+        if min_id is None:
+            return
+
+        args = [None, None]
+        sql = self._compile(args)
+        args = args[2:]
+
+        start = min_id - 1 if last_id is None else last_id
+        total = max_id - min_id + 1
+
+        while start < max_id:
+            stop = min(start + self.batch_size, max_id)
+            yield (sql, start, stop, *args), {
+                'last_id': stop,
+                'max_id': max_id,
+                'progress': (stop - min_id + 1) / total,
+                'done': stop >= max_id,
+            }
+            start = stop
+
+
+def _get_online_alter_column(conf):
+    # Split one AlterColumn into steps that hold ACCESS EXCLUSIVE only
+    # for catalog updates, never for a full table scan
+    table_name = conf['table_name']
+    column_name = conf['column_name']
+    column = conf['column']
+
+    changes = list(conf['changes'])
+    phases = []
+
+    set_not_null = 'nullable' in changes and not column['nullable']
+    add_unique = 'unique' in changes and column['unique']
+
+    if set_not_null:
+        changes.remove('nullable')
+    if add_unique:
+        changes.remove('unique')
+
+    if changes:
+        phases.append((0, (AlterColumn, dict(conf, changes=changes))))
+
+    if set_not_null:
+        # SET NOT NULL skips the table scan when a valid CHECK proves it
+        check_name = f'{table_name}_{column_name}_not_null'
+        check = {'table_name': table_name, 'name': check_name}
+
+        phases.append((1, (AddConstraint, dict(
+            check, check=f'"{column_name}" IS NOT NULL', not_valid=True,
+        ))))
+        phases.append((2, (ValidateConstraint, check)))
+        phases.append((3, (AlterColumn, dict(conf, changes=['nullable']))))
+        phases.append((4, (DropConstraint, check)))
+
+    if add_unique:
+        phases.append((INDEX_PHASE, (CreateIndex, {
+            'table_name': table_name,
+            'name': f'{table_name}_{column_name}_key',
+            'index': {
+                'columns': [f'"{column_name}"'],
+                'method': 'btree',
+                'unique': True,
+                'where': None,
+            },
+            'constraint': True,
+        })))
+        phases.append((INDEX_PHASE + 1, (
+            AlterColumn, dict(conf, changes=['unique'], using_index=True)
+        )))
+
+    return phases
+
+
+def _get_online_operations(operations):
+    phases = []
+
+    for operation_class, operation_kwargs in operations:
+        if operation_class is AlterColumn:
+            phases += _get_online_alter_column(operation_kwargs)
+        elif operation_class in (CreateIndex, DropIndex):
+            phases.append((INDEX_PHASE, (operation_class, operation_kwargs)))
+        else:
+            phases.append((0, (operation_class, operation_kwargs)))
+
+    # The same step of every column runs together, so rewriting changes
+    # share one statement and each lock is taken once per step
+    phases.sort(key=lambda phase: phase[0])
+
+    return [operation for _, operation in phases]
+
+
+def _coalesce_operations(operations):
+    # Consecutive actions on one table are merged into a single ALTER TABLE
+    coalesced = []
+
+    for operation_class, operation_kwargs in operations:
+        if operation_class.__name__ not in ALTER_OPERATIONS:
+            coalesced.append((operation_class, operation_kwargs))
+            continue
+
+        table_name = operation_kwargs['table_name']
+        operation = [operation_class.__name__, operation_kwargs]
+
+        if coalesced:
+            previous_class, previous_kwargs = coalesced[~0]
+            if previous_class is AlterTable and previous_kwargs['table_name'] == table_name:
+                previous_kwargs['operations'].append(operation)
+                continue
+
+        coalesced.append((AlterTable, {'table_name': table_name, 'operations': [operation]}))
+
+    # A single action keeps its own operation
+    return [
+        (ALTER_OPERATIONS[operation_kwargs['operations'][0][0]], operation_kwargs['operations'][0][1])
+        if operation_class is AlterTable and len(operation_kwargs['operations']) == 1
+        else (operation_class, operation_kwargs)
+        for operation_class, operation_kwargs in coalesced
+    ]
+
+
+def _get_costs(operations):
+    costs = {}
+
+    for operation in operations:
+        table_name = operation.conf.get('table_name', operation.conf.get('name'))
+        cost = costs.setdefault(table_name, {'rewrites': 0, 'locks': {}})
+
+        if operation.rewrite:
+            cost['rewrites'] += 1
+        cost['locks'][operation.lock] = cost['locks'].get(operation.lock, 0) + 1
+
+    return costs
+
+
+def _get_indexes_diff(table_name, indexes, current_indexes):
+    operations = []
+
+    for name, index in current_indexes.items():
+        if indexes.get(name) != index:
+            operations.append((DropIndex, {
+                'table_name': table_name,
+                'name': name,
+            }))
+
+    for name, index in indexes.items():
+        if current_indexes.get(name) != index:
+            operations.append((CreateIndex, {
+                'table_name': table_name,
+                'name': name,
+                'index': index,
+            }))
+
+    return operations
+
+
+def _get_operations_diff(structure, online=False):
     operations = []
 
     table_name = structure['name']
@@ -134,23 +509,29 @@ def _get_operations_diff(structure):
     current = _structures[table_name]
     current_columns = current['columns']
 
-    current_columns_set = set(current_columns.keys())
-    columns_set = set(columns.keys())
+    for removed_column in current_columns:
+        if removed_column in columns:
+            continue
 
-    for removed_column in current_columns_set - columns_set:
         operations.append((DeleteColumn, {
             'table_name': table_name,
             'column_name': removed_column,
         }))
 
-    for added_column in columns_set - current_columns_set:
+    for added_column in columns:
+        if added_column in current_columns:
+            continue
+
         operations.append((AddColumn, {
             'table_name': table_name,
             'column_name': added_column,
             'column': columns[added_column],
         }))
 
-    for column_name in current_columns_set & columns_set:
+    for column_name in columns:
+        if column_name not in current_columns:
+            continue
+
         column = columns[column_name]
         current_column = current_columns[column_name]
         if current_column != column:
@@ -172,6 +553,13 @@ def _get_operations_diff(structure):
                 'changes': changes,
             }))
 
+    operations += _get_indexes_diff(
+        table_name, structure['indexes'], current.get('indexes', {})
+    )
+
+    if online:
+        operations = _get_online_operations(operations)
+
     return operations
 
 
@@ -189,28 +577,41 @@ def _create_migration_file(migrations_module_path, last_migration, operations):
     salt = str(uuid.uuid4()).split('-')[0]
     new_migration = f'{i:04d}_{salt}.py'
 
+    operations = [
+        operation_class(json.loads(json.dumps(operation_kwargs, sort_keys=True)))
+        for operation_class, operation_kwargs in operations
+    ]
+
     fn = os.path.join(migrations_module_path.replace('.', os.path.sep), new_migration)
     with open(fn, 'w+') as fo:
+        fo.write('from sql import migration\n\n')
+
+        # Estimated cost: table rewrites and statements per lock level
+        for table_name, cost in _get_costs(operations).items():
+            locks = ', '.join(f'{lock} x{count}' for lock, count in cost['locks'].items())
+            fo.write(f'# {table_name}: rewrites x{cost["rewrites"]}, {locks}\n')
+
         fo.write(
-            'from sql import migration\n\n'
-            'def up():\n'
+            '\ndef up():\n'
             '    return (\n'
         )
 
-        for operation_class, operation_kwargs in operations:
-            conf = json.dumps(operation_kwargs, sort_keys=True)
-            conf = json.loads(conf)
-
-            fo.write(f'        migration.{operation_class.__name__}({conf}),\n')
+        for operation in operations:
+            lock = f'{operation.lock}, rewrite' if operation.rewrite else operation.lock
+            fo.write(f'        migration.{type(operation).__name__}({operation.conf}),  # {lock}\n')
 
         fo.write('    )\n')
 
+    return os.path.splitext(new_migration)[0]
+
 
 def _get_model_structure(model):
     columns = {}
+    indexes = {}
     structure = {
         'name': model.Meta.table_name,
         'columns': columns,
+        'indexes': indexes,
     }
 
     for name, field in model.Meta.fields.items():
@@ -230,6 +631,15 @@ def _get_model_structure(model):
             'default': default,
         }
 
+        if field.index:
+            method = 'btree' if field.index is True else field.index
+            index_name, index = Index(field, method=method).get_structure(model)
+            indexes[index_name] = index
+
+    for index in model.Meta.indexes:
+        index_name, index = index.get_structure(model)
+        indexes[index_name] = index
+
     return structure
 
 
@@ -264,15 +674,75 @@ def _get_column_sql(column_name, column):
     return ' '.join(column_sql)
 
 
-def migrate(migrations_module_path, last_migration=None):
+def _get_migrations_list(migrations_module_path):
     migrations_list = []
     for file_name in os.listdir(migrations_module_path.replace('.', os.path.sep)):
         file_name, file_extension = os.path.splitext(file_name)
-        if file_extension == '.py':
+        if file_extension == '.py' and not file_name.startswith('_'):
             migrations_list.append(file_name)
 
     migrations_list.sort()
 
+    return migrations_list
+
+
+def _get_migrations_hash(migrations_module_path, migrations_list):
+    # Changes whenever any migration up to the last one is added, removed
+    # or edited, which makes the snapshot stale
+    path = migrations_module_path.replace('.', os.path.sep)
+
+    digest = hashlib.sha256()
+    for migration_item in migrations_list:
+        digest.update(migration_item.encode())
+        with open(os.path.join(path, f'{migration_item}.py'), 'rb') as fo:
+            digest.update(fo.read())
+
+    return digest.hexdigest()
+
+
+def _get_snapshot_path(migrations_module_path, migration_item):
+    path = migrations_module_path.replace('.', os.path.sep)
+    return os.path.join(path, f'{migration_item}.json')
+
+
+def _load_snapshot(migrations_module_path, migration_item, migrations_hash):
+    fn = _get_snapshot_path(migrations_module_path, migration_item)
+
+    try:
+        with open(fn) as fo:
+            snapshot = json.load(fo)
+    except (OSError, ValueError):
+        return None
+
+    if snapshot.get('hash') != migrations_hash:
+        return None
+
+    return snapshot['structures']
+
+
+def _save_snapshot(migrations_module_path, migration_item, migrations_hash):
+    fn = _get_snapshot_path(migrations_module_path, migration_item)
+
+    with open(fn, 'w+') as fo:
+        json.dump({
+            'hash': migrations_hash,
+            'structures': _structures,
+        }, fo, sort_keys=True)
+
+
+def _replay_migrations(migrations_module_path, migrations_list):
+    for migration_item in migrations_list:
+        migration = pydoc.locate(
+            os.path.join(migrations_module_path, migration_item)
+            .replace(os.path.sep, '.')
+        )
+
+        _apply_migration_structure(migration.up())
+
+
+def migrate(migrations_module_path, last_migration=None):
+    migrations_list = _get_migrations_list(migrations_module_path)
+
     if last_migration:
         start = migrations_list.index(last_migration) + 1
     else:
@@ -289,38 +759,56 @@ def migrate(migrations_module_path, last_migration=None):
         yield migration_item, migration.up()
 
 
-def create_migrations(migrations_module_path, last_migration=None):
-
-    if last_migration:
-        migrations_list = []
-        for file_name in os.listdir(migrations_module_path.replace('.', os.path.sep)):
-            file_name, file_extension = os.path.splitext(file_name)
-            if file_extension == '.py':
-                migrations_list.append(file_name)
+def create_migrations(migrations_module_path, last_migration=None, online=False,
+                      lock_timeout=None):
+    _structures.clear()
 
-        migrations_list.sort()
+    migrations_list = []
 
-        stop_iteration = False
-        for migration_item in migrations_list:
-            if stop_iteration:
-                raise 'Apply migrations before create a new one'
+    if last_migration:
+        migrations_list = _get_migrations_list(migrations_module_path)
 
-            stop_iteration = migration_item == last_migration
+        if migrations_list[~0] != last_migration:
+            raise Exception('Apply migrations before create a new one')
 
-            migration = pydoc.locate(
-                os.path.join(migrations_module_path, migration_item)
-                .replace(os.path.sep, '.')
-            )
+        migrations_hash = _get_migrations_hash(migrations_module_path, migrations_list)
+        structures = _load_snapshot(migrations_module_path, last_migration, migrations_hash)
 
-            _apply_migration_structure(migration.up())
+        if structures is None:
+            _replay_migrations(migrations_module_path, migrations_list)
+            _save_snapshot(migrations_module_path, last_migration, migrations_hash)
+        else:
+            _structures.update(structures)
 
     operations = []
-    for model in ModelManager.models:
+    for model in sorted(ModelManager.models, key=lambda model: model.Meta.table_name):
         structure = _get_model_structure(model)
         if structure['name'] in _structures:
-            operations += _get_operations_diff(structure)
+            operations += _get_operations_diff(structure, online)
         else:
+            indexes = structure.pop('indexes')
             operations.append((CreateTable, structure))
+            operations += _get_indexes_diff(structure['name'], indexes, {})
+
+    operations = _coalesce_operations(operations)
+
+    if online and lock_timeout is None:
+        lock_timeout = ONLINE_LOCK_TIMEOUT
+
+    if lock_timeout is not None:
+        for _, operation_kwargs in operations:
+            operation_kwargs['lock_timeout'] = lock_timeout
 
     if operations:
-        _create_migration_file(migrations_module_path, last_migration, operations)
+        new_migration = _create_migration_file(migrations_module_path, last_migration, operations)
+
+        _apply_migration_structure(
+            operation_class(json.loads(json.dumps(operation_kwargs)))
+            for operation_class, operation_kwargs in operations
+        )
+
+        migrations_list.append(new_migration)
+        _save_snapshot(
+            migrations_module_path, new_migration,
+            _get_migrations_hash(migrations_module_path, migrations_list),
+        )
@@ -1,8 +1,9 @@
-from sql.query import Q
+from sql.query import Q, placeholder
 from sql.field import Field
 
 
 class SelectValuesMixin:
+    __slots__ = ()
 
     def values(self, *args, **kwargs):
         for value in args:
@@ -30,6 +31,19 @@ class SelectValuesMixin:
             elif isinstance(value, dict):
                 self._collect_dependencies_recursive(value)
 
+    def _collect_recursive(self, fields, shape, args):
+        shape.append(dict)
+        for name, value in fields.items():
+            shape.append(name)
+            if isinstance(value, Q):
+                value.collect(shape, args)
+            elif isinstance(value, dict):
+                self._collect_recursive(value, shape, args)
+            else:
+                shape.append('{}')
+                args.append(value)
+        shape.append(None)
+
     def _json_build_object_recursive(self, fields, args):
         json_object = []
         for name, value in fields.items():
@@ -38,8 +52,51 @@ class SelectValuesMixin:
             elif isinstance(value, dict):
                 json_object.append(f"'{name}', {self._json_build_object_recursive(value, args)}")
             else:
-                json_object.append(f"'{name}', {{}}")
-                args.append(value)
+                json_object.append(f"'{name}', {placeholder(args, value)}")
 
         json_object = ','.join(json_object)
         return f'JSON_BUILD_OBJECT({json_object})'
+
+
+class WriteMixin:
+    # Shared by the INSERT, UPDATE and DELETE builders
+
+    def _get_field(self, column):
+        if isinstance(column, Field):
+            column = column.name
+
+        for name, field in self.table.Meta.fields.items():
+            if column in (name, field.name):
+                return name, field
+
+        raise Exception(f'Unknown column {column} for {self.table}')
+
+    def returning(self, *args, **kwargs):
+        for value in args:
+            if isinstance(value, Field):
+                self._returning[value.name] = value
+            else:
+                raise Exception('Position argument must be instance of Field')
+
+        self._returning.update(kwargs)
+        return self
+
+    def _compile_table(self):
+        meta = self.table.Meta
+        if meta.alias == meta.table_name:
+            return f'"{meta.table_name}"'
+        else:
+            return f'"{meta.table_name}" AS "{meta.alias}"'
+
+    def _compile_returning(self, args):
+        if not self._returning:
+            return []
+
+        values = []
+        for name, value in self._returning.items():
+            if isinstance(value, Q):
+                values.append(f'{value.compile(args)} "{name}"')
+            else:
+                values.append(f'{placeholder(args, value)} "{name}"')
+
+        return ['RETURNING', ', '.join(values)]
@@ -1,3 +1,4 @@
+import weakref
 from copy import copy
 
 from sql.field import Field
@@ -22,10 +23,12 @@ class Meta(metaclass=MetaManager):
     table_name = None
     verbose_name = None
     verbose_name_plural = None
+    indexes = ()
 
 
 class ModelManager(type):
     models = set()
+    aliases = weakref.WeakValueDictionary()
 
     def __new__(mcs, name, bases, initial):
         if bases:
@@ -34,13 +37,15 @@ class ModelManager(type):
             cls = super().__new__(mcs, name, bases, initial)
             cls.Meta = create_meta(cls, alias, cls.Meta)
 
-            if not alias:
+            if alias:
+                # Aliased model has exactly the fields of the model it aliases
+                fields = bases[0].Meta.fields
+            else:
                 mcs.models.add(cls)
+                fields = get_fields(cls)
 
-            for field_name in dir(cls):
-                field = getattr(cls, field_name)
-                if isinstance(field, Field):
-                    bind_field(cls, field_name, field)
+            for field_name, field in fields.items():
+                bind_field(cls, field_name, field)
 
             return cls
         else:
@@ -50,9 +55,14 @@ class ModelManager(type):
         yield from self.Meta.fields.values()
 
     def __getitem__(cls, alias):
-        return ModelManager(cls.__name__, (cls, ), {
-            '__alias__': alias,
-        })
+        key = cls, alias
+        model = ModelManager.aliases.get(key)
+        if model is None:
+            model = ModelManager(cls.__name__, (cls, ), {
+                '__alias__': alias,
+            })
+            ModelManager.aliases[key] = model
+        return model
 
     def __str__(cls):
         if cls.Meta.alias == cls.Meta.table_name:
@@ -73,13 +83,28 @@ def create_meta(model, alias, base_meta):
     return MetaManager('Meta', (base_meta, Meta), {
         'model': model,
         'alias': alias,
+        # Shared by all fields of the model
+        'dependencies': frozenset((model, )),
     })
 
 
+def get_fields(cls):
+    fields = {}
+    for base in reversed(cls.__mro__):
+        for name, value in vars(base).items():
+            if isinstance(value, Field):
+                fields[name] = value
+            elif name in fields:
+                del fields[name]
+
+    # Same order dir() used to give
+    return {name: fields[name] for name in sorted(fields)}
+
+
 def bind_field(cls, name, field):
     field = copy(field)
     field.table = cls
-    field.dependencies = {cls}
+    field.dependencies = cls.Meta.dependencies
     field.name = field.name or name
     setattr(cls, name, field)
     cls.Meta.fields[name] = field
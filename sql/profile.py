@@ -0,0 +1,161 @@
+import json
+import bisect
+import hashlib
+from contextlib import contextmanager
+
+# Active profiler, None keeps the hot path down to a single check
+profiler = None
+
+BUILD_TIME_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+)
+
+EXECUTION_TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def as_dict(self):
+        return {
+            'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+        }
+
+
+class ShapeStats:
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.label = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        self.build_time = Histogram(BUILD_TIME_BUCKETS)
+        self.execution_time = Histogram(EXECUTION_TIME_BUCKETS)
+        self.sql_length = len(sql)
+        self.args_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self):
+        return {
+            'sql': self.sql,
+            'build_time': self.build_time.as_dict(),
+            'execution_time': self.execution_time.as_dict(),
+            'sql_length': self.sql_length,
+            'args_count': self.args_count,
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+        }
+
+
+class Profiler:
+
+    def __init__(self):
+        self.shapes = {}
+
+    def _get_stats(self, sql):
+        stats = self.shapes.get(sql)
+        if stats is None:
+            stats = self.shapes[sql] = ShapeStats(sql)
+        return stats
+
+    def record_execution(self, sql, execution_time):
+        self._get_stats(sql).execution_time.observe(execution_time)
+
+    def record(self, sql, build_time, args_count, cache_hit):
+        stats = self._get_stats(sql)
+        stats.build_time.observe(build_time)
+        stats.args_count = args_count
+        if cache_hit:
+            stats.hits += 1
+        else:
+            stats.misses += 1
+
+    def stats(self):
+        return {stats.label: stats.as_dict() for stats in self.shapes.values()}
+
+    def dump(self, fo):
+        json.dump(self.stats(), fo, indent=2, sort_keys=True)
+
+    def prometheus(self):
+        lines = [
+            '# TYPE sql_build_seconds histogram',
+        ]
+        for stats in self.shapes.values():
+            lines.extend(_get_histogram_lines('sql_build_seconds', stats.label, stats.build_time))
+
+        lines.append('# TYPE sql_execution_seconds histogram')
+        for stats in self.shapes.values():
+            lines.extend(_get_histogram_lines('sql_execution_seconds', stats.label, stats.execution_time))
+
+        lines.append('# TYPE sql_statement_length gauge')
+        lines.extend(
+            f'sql_statement_length{{shape="{stats.label}"}} {stats.sql_length}'
+            for stats in self.shapes.values()
+        )
+
+        lines.append('# TYPE sql_statement_args gauge')
+        lines.extend(
+            f'sql_statement_args{{shape="{stats.label}"}} {stats.args_count}'
+            for stats in self.shapes.values()
+        )
+
+        lines.append('# TYPE sql_statement_cache_hits_total counter')
+        lines.extend(
+            f'sql_statement_cache_hits_total{{shape="{stats.label}"}} {stats.hits}'
+            for stats in self.shapes.values()
+        )
+
+        return '\n'.join(lines) + '\n'
+
+
+def _get_histogram_lines(name, label, histogram):
+    label = f'shape="{label}"'
+    cumulative = 0
+    for bucket, count in zip([*histogram.buckets, '+Inf'], histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{label},le="{bucket}"}} {cumulative}'
+    yield f'{name}_sum{{{label}}} {histogram.sum}'
+    yield f'{name}_count{{{label}}} {histogram.count}'
+
+
+def enable(new_profiler=None):
+    global profiler
+    profiler = new_profiler or Profiler()
+    return profiler
+
+
+def disable():
+    global profiler
+    profiler = None
+
+
+@contextmanager
+def profile(new_profiler=None):
+    global profiler
+    previous = profiler
+    current = enable(new_profiler)
+    try:
+        yield current
+    finally:
+        profiler = previous
@@ -1,4 +1,70 @@
+import re
+from functools import lru_cache
+from collections.abc import Iterator, Sequence, Set
+
+# Shared by every expression that doesn't reference a table
+EMPTY_DEPENDENCIES = frozenset()
+
+# `{}` marks a value in Q queries, `{{` and `}}` are literal braces
+_MARKERS = re.compile(r'\{\{|\}\}|\{\}')
+
+# `$n` outside of literals, quoted identifiers, dollar quotes and comments
+_PLACEHOLDERS = re.compile(
+    r"""(?<!\w)[eE]'(?:[^'\\]|\\.|'')*'"""
+    r"""|'(?:[^']|'')*'"""
+    r'|"(?:[^"]|"")*"'
+    r'|(\$(?:[A-Za-z_]\w*)?\$).*?\1'
+    r'|--[^\n]*|/\*.*?\*/'
+    r'|\$(\d+)',
+    re.DOTALL,
+)
+
+
+@lru_cache(maxsize=4096)
+def _split(query):
+    segments = []
+    chunk = []
+    start = 0
+    for match in _MARKERS.finditer(query):
+        chunk.append(query[start:match.start()])
+        start = match.end()
+        if match[0] == '{}':
+            segments.append(''.join(chunk))
+            chunk = []
+        else:
+            chunk.append(match[0][0])
+    chunk.append(query[start:])
+    segments.append(''.join(chunk))
+    return tuple(segments)
+
+
+def placeholder(args, value):
+    # Statements are rendered with final $n placeholders, n being the
+    # position of the value in args
+    args.append(value)
+    return f'${len(args)}'
+
+
+def _sub_placeholders(query, replace):
+    return _PLACEHOLDERS.sub(
+        lambda match: match[0] if match[2] is None else replace(int(match[2])),
+        query,
+    )
+
+
+def inline(query, args, render=str):
+    return _sub_placeholders(query, lambda n: render(args[n - 1]))
+
+
+def renumber(query, offset):
+    # Shifts placeholders of a statement embedded after `offset` other args
+    if not offset:
+        return query
+    return _sub_placeholders(query, lambda n: f'${n + offset}')
+
+
 class F:
+    __slots__ = ('query', )
 
     def __init__(self, query: str):
         self.query = query
@@ -8,10 +74,15 @@ class F:
 
 
 class Q:
+    __slots__ = ('query', 'args', 'dependencies')
+
+    # Cast of array parameters compared with this expression, None lets
+    # the server infer it
+    array_type = None
 
     def __init__(self, query: str, *args, _dependencies=None, **kwargs):
         self.query = query
-        self.dependencies = _dependencies or set()
+        self.dependencies = _dependencies or EMPTY_DEPENDENCIES
         self.args = args
 
         if kwargs:
@@ -21,38 +92,46 @@ class Q:
             self.query = query % kwargs
 
     def __str__(self):
-        return f'<query: {self.query.format(*self.args)}>'
+        args = []
+        query = self.compile(args)
+        return f'<query: {inline(query, args)}>'
 
     def __repr__(self):
         return str(self)
 
     def compile(self, args):
+        segments = _split(self.query)
+        if len(segments) != len(self.args) + 1:
+            raise Exception(f'Query {self.query} expects {len(segments) - 1} values')
+
+        position = len(args)
+        args.extend(self.args)
+        if len(segments) == 2:
+            return f'{segments[0]}${position + 1}{segments[1]}'
+
+        sql = [segments[0]]
+        for segment in segments[1:]:
+            position += 1
+            sql.append(f'${position}')
+            sql.append(segment)
+        return ''.join(sql)
+
+    def collect(self, shape, args):
+        # Placeholder numbers follow from the shape, no need to render them
+        shape.append(self.query)
         args.extend(self.args)
-        return self.query
 
     # Operators
 
     def __operand__(self, operand, value, before='', after=''):
-        args = []
-        query = self.compile(args)
-
+        dependencies = self.dependencies
         if isinstance(value, Q):
-            value_args = []
-            value_query = value.compile(value_args)
-            return Q(
-                f'(({query}) {operand} {before}({value_query}){after})',
-                *args, *value_args,
-                _dependencies=(
-                    self.dependencies.union(value.dependencies)
-                    if value.dependencies else self.dependencies
-                )
-            )
-        else:
-            return Q(
-                f'(({query}) {operand} {before}{{}}{after})',
-                *args, value,
-                _dependencies=self.dependencies
-            )
+            dependencies = _union(dependencies, value.dependencies)
+
+        return Operator(
+            operand, self, value, before, after,
+            _dependencies=dependencies
+        )
 
     def __eq__(self, val):
         return self.__operand__('=', val)
@@ -83,27 +162,36 @@ class Q:
             return self.range(key.start, key.stop)
 
         # Json path
-        args = []
-        query = self.compile(args)
-
-        path_chunks = query.rsplit('->>', 1)
-        if len(path_chunks) > 1:
-            return Q(
-                f'({path_chunks[0]})->{path_chunks[~0]}->>{{}}',
-                *args, key
-            )
-        else:
-            return Q(f'({path_chunks[0]})->>{{}}', *args, key)
+        return JsonPath(self, (key, ))
 
     def any(self, val):
-        return self.__operand__('IN', val)
+        return self.__array_operand__('= ANY', val)
+
+    def not_any(self, val):
+        return self.__array_operand__('<> ALL', val)
+
+    def __array_operand__(self, operand, val):
+        if isinstance(val, Q):
+            # Subquery or array expression
+            return self.__operand__(operand, val)
+
+        # Whole list is bound as one array, so the statement text doesn't
+        # depend on its length. Params and other values are bound as they are
+        if isinstance(val, (Sequence, Set, Iterator)) and not isinstance(val, (str, bytes, bytearray)):
+            val = list(val)
+
+        cast = f'::{self.array_type}' if self.array_type else ''
+        return self.__operand__(operand, val, '(', f'{cast})')
+
+    def asc(self):
+        return Order(self, 'ASC')
+
+    def desc(self):
+        return Order(self, 'DESC')
 
     def range(self, start, stop):
-        args = []
-        query = self.compile(args)
-        return Q(
-            f'({query}) BETWEEN {{}} AND {{}}',
-            *args, start, stop,
+        return Expression(
+            '(', self, ') BETWEEN ', Q('{}', start), ' AND ', Q('{}', stop),
             _dependencies=self.dependencies
         )
 
@@ -143,3 +231,148 @@ class Q:
 
     def array_concat(self, value):
         return self.__operand__('||', value)
+
+
+def _union(dependencies, other):
+    # Reuse existing sets instead of allocating a new one per operator
+    if not other or other <= dependencies:
+        return dependencies
+    elif not dependencies:
+        return other
+    return frozenset(dependencies | other)
+
+
+class Node(Q):
+    # Lazy node: parts are rendered only once, when the final statement is
+    # compiled, instead of re-copying operand strings on every operator
+    __slots__ = ()
+
+    def _parts(self):
+        raise NotImplementedError
+
+    def _walk(self):
+        # Iterative, so that chains of thousands of operators don't hit the
+        # recursion limit
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Node):
+                stack.extend(reversed(node._parts()))
+            else:
+                yield node
+
+    def compile(self, args):
+        return ''.join([
+            node if isinstance(node, str) else node.compile(args)
+            for node in self._walk()
+        ])
+
+    def collect(self, shape, args):
+        for node in self._walk():
+            if isinstance(node, str):
+                shape.append(node)
+            else:
+                node.collect(shape, args)
+
+
+class Expression(Node):
+    __slots__ = ('parts', )
+
+    def __init__(self, *parts, _dependencies=None):
+        self.parts = parts
+        self.dependencies = _dependencies or EMPTY_DEPENDENCIES
+
+    def _parts(self):
+        return self.parts
+
+
+class Operator(Node):
+    __slots__ = ('operand', 'left', 'right', 'before', 'after')
+
+    associative = {'AND', 'OR'}
+
+    def __init__(self, operand, left, right, before='', after='',
+                 _dependencies=None):
+        self.operand = operand
+        self.left = left
+        self.right = right
+        self.before = before
+        self.after = after
+        self.dependencies = _dependencies or EMPTY_DEPENDENCIES
+
+    def _is_chain(self, node):
+        return (
+            isinstance(node, Operator) and
+            node.operand == self.operand and
+            isinstance(node.right, Q) and
+            not (node.before or node.after)
+        )
+
+    def _parts(self):
+        if not isinstance(self.right, Q):
+            return (
+                '((', self.left, f') {self.operand} {self.before}',
+                Q('{}', self.right), f'{self.after})',
+            )
+
+        if self.operand in self.associative and self._is_chain(self):
+            # Flatten ((a AND b) AND c) into (a AND b AND c)
+            operands = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if self._is_chain(node):
+                    stack.append(node.right)
+                    stack.append(node.left)
+                else:
+                    operands.append(node)
+
+            parts = ['((']
+            for operand in operands:
+                parts.append(operand)
+                parts.append(f') {self.operand} (')
+            parts[~0] = '))'
+            return parts
+
+        return (
+            '((', self.left, f') {self.operand} {self.before}(',
+            self.right, f'){self.after})',
+        )
+
+
+class JsonPath(Node):
+    __slots__ = ('source', 'keys')
+
+    array_type = 'text[]'
+
+    def __init__(self, source, keys):
+        self.source = source
+        self.keys = keys
+        self.dependencies = source.dependencies
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.range(key.start, key.stop)
+
+        return JsonPath(self.source, self.keys + (key, ))
+
+    def _parts(self):
+        parts = ['(', self.source, ')']
+        for key in self.keys[:~0]:
+            parts.append('->')
+            parts.append(Q('{}', key))
+        parts.append('->>')
+        parts.append(Q('{}', self.keys[~0]))
+        return parts
+
+
+class Order(Node):
+    __slots__ = ('source', 'direction')
+
+    def __init__(self, source, direction='ASC'):
+        self.source = source
+        self.direction = direction
+        self.dependencies = source.dependencies
+
+    def _parts(self):
+        return self.source, f' {self.direction}'
@@ -0,0 +1,284 @@
+import os
+import sys
+import time
+import uuid
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+# Active result cache, None keeps Select.cached() queries going to the database
+cache = None
+
+
+def get_tables(tables):
+    # Entries are tracked per table, so every alias of a model shares them
+    return frozenset(
+        table if isinstance(table, str) else table.Meta.table_name
+        for table in tables
+    )
+
+
+def get_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes)):
+        return size
+    elif isinstance(value, dict):
+        return size + sum(get_size(key) + get_size(item) for key, item in value.items())
+    elif hasattr(value, '__iter__'):
+        # Rows of any driver: tuples, lists, asyncpg records
+        return size + sum(get_size(item) for item in value)
+    return size
+
+
+class MemoryBackend:
+
+    def __init__(self, maxbytes=64 * 1024 * 1024):
+        self.maxbytes = maxbytes
+        self.size = 0
+
+        self._entries = OrderedDict()
+        self._tables = {}
+        self._versions = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def versions(self, tables):
+        return tuple(self._versions.get(table, 0) for table in sorted(tables))
+
+    def get(self, key):
+        try:
+            entry, _, _ = self._entries[key]
+        except KeyError:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry, tables):
+        size = get_size(entry[~0])
+        if size > self.maxbytes:
+            return
+
+        self.delete(key)
+        self._entries[key] = entry, tables, size
+        self.size += size
+        for table in tables:
+            self._tables.setdefault(table, set()).add(key)
+
+        while self.size > self.maxbytes:
+            self.delete(next(iter(self._entries)))
+
+    def delete(self, key):
+        try:
+            _, tables, size = self._entries.pop(key)
+        except KeyError:
+            return
+
+        self.size -= size
+        for table in tables:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+    def invalidate(self, tables):
+        for table in tables:
+            self._versions[table] = self._versions.get(table, 0) + 1
+            for key in list(self._tables.pop(table, ())):
+                self.delete(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._tables.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'size': len(self._entries), 'bytes': self.size, 'maxbytes': self.maxbytes}
+
+
+class SharedMemoryBackend:
+    # Entries are files on tmpfs, shared by all processes of the host.
+    # Invalidation replaces the version token of the table, entries stored
+    # with an older token are dropped on read
+
+    def __init__(self, path=None, maxbytes=256 * 1024 * 1024):
+        if path is None:
+            root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(root, 'sql-results')
+
+        self.path = path
+        self.maxbytes = maxbytes
+
+        self._written = 0
+        self._entries_path = os.path.join(path, 'entries')
+        self._tables_path = os.path.join(path, 'tables')
+
+        os.makedirs(self._entries_path, exist_ok=True)
+        os.makedirs(self._tables_path, exist_ok=True)
+
+    def __len__(self):
+        return len(os.listdir(self._entries_path))
+
+    def _write(self, path, data):
+        # Atomic, readers see either the old or the new file
+        temp_path = f'{path}.{uuid.uuid4().hex}'
+        with open(temp_path, 'wb') as fo:
+            fo.write(data)
+        os.replace(temp_path, path)
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as fo:
+                return fo.read()
+        except FileNotFoundError:
+            return None
+
+    def versions(self, tables):
+        return tuple(
+            self._read(os.path.join(self._tables_path, table)) or b''
+            for table in sorted(tables)
+        )
+
+    def get(self, key):
+        path = os.path.join(self._entries_path, key)
+        data = self._read(path)
+        if data is None:
+            return None
+
+        try:
+            entry = pickle.loads(data)
+        except Exception:
+            self.delete(key)
+            return None
+
+        try:
+            # Access time for the LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return entry
+
+    def set(self, key, entry, tables):
+        try:
+            data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Rows the driver can't pickle are not cached
+            return
+
+        if len(data) > self.maxbytes:
+            return
+
+        self._write(os.path.join(self._entries_path, key), data)
+
+        self._written += len(data)
+        if self._written > self.maxbytes // 8:
+            self._written = 0
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        size = 0
+        for item in os.scandir(self._entries_path):
+            try:
+                stat = item.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, item.path))
+            size += stat.st_size
+
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def delete(self, key):
+        try:
+            os.remove(os.path.join(self._entries_path, key))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, tables):
+        for table in tables:
+            self._write(os.path.join(self._tables_path, table), uuid.uuid4().bytes)
+
+    def clear(self):
+        for item in os.scandir(self._entries_path):
+            try:
+                os.remove(item.path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {'size': len(self), 'maxbytes': self.maxbytes}
+
+
+class ResultCache:
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = MemoryBackend() if backend is None else backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, method, statement):
+        return hashlib.sha1(pickle.dumps((method, *statement))).hexdigest()
+
+    async def fetch(self, method, statement, tables, run, ttl=None):
+        tables = get_tables(tables)
+        key = self.get_key(method, statement)
+
+        # Taken before running the query, so a write that lands meanwhile
+        # makes the stored entry stale right away
+        versions = self.backend.versions(tables)
+
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires, entry_versions, value = entry
+            if entry_versions == versions and expires > time.time():
+                self.hits += 1
+                return value
+            self.backend.delete(key)
+
+        self.misses += 1
+        value = await run()
+
+        ttl = self.ttl if ttl is None else ttl
+        self.backend.set(key, (time.time() + ttl, versions, value), tables)
+
+        return value
+
+    def invalidate(self, *tables):
+        self.backend.invalidate(get_tables(tables))
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, **self.backend.stats()}
+
+
+def enable(new_cache=None):
+    global cache
+    cache = new_cache or ResultCache()
+    return cache
+
+
+def disable():
+    global cache
+    cache = None
+
+
+def invalidate(*tables):
+    if cache is not None:
+        cache.invalidate(*tables)
@@ -1,8 +1,21 @@
-from sql.query import Q
+import json
+from contextlib import aclosing
+from time import perf_counter
+
+from sql import executor, profile, results
+from sql.cache import statements
+from sql.cursor import Cursor
+from sql.helpers import encode_cursor, decode_cursor
+from sql.query import Q, Node, Order, Expression, placeholder
+from sql.template import Template
 from sql.mixins import SelectValuesMixin
 
 
 class Select(SelectValuesMixin, Q):
+    __slots__ = (
+        '_fields', '_joins', '_filters', '_groups', '_orders', '_cursor', '_limit',
+        '_prefetches', '_cached', '_ttl',
+    )
 
     alias = ''
 
@@ -13,7 +26,12 @@ class Select(SelectValuesMixin, Q):
         self._joins = {}
         self._filters = []
         self._groups = []
+        self._orders = []
+        self._cursor = None
         self._limit = None, None
+        self._prefetches = {}
+        self._cached = False
+        self._ttl = None
 
         self.values(*args, **kwargs)
 
@@ -28,6 +46,18 @@ class Select(SelectValuesMixin, Q):
     def join_full(self, table, condition):
         return self.join(table, condition, mode='FULL')
 
+    def prefetch(self, child, on=None, values=None, name=None, order=(), limit=None):
+        # Related rows as a JSON array column, one correlated subquery per
+        # relation, so parent rows are never duplicated by one-to-many joins
+        if isinstance(child, Prefetch):
+            relation = child
+        else:
+            relation = Prefetch(child, on, values, name, order, limit)
+
+        self._prefetches[relation.name] = relation
+        self._fields[relation.name] = Q(f'"{relation.alias}"."{relation.name}"')
+        return self
+
     def filter(self, *args):
         self._filters.extend(args)
         return self
@@ -36,6 +66,101 @@ class Select(SelectValuesMixin, Q):
         self._groups = args
         return self
 
+    def order(self, *args):
+        self._orders = [
+            value if isinstance(value, Order) else Order(value)
+            for value in args
+        ]
+        return self
+
+    def seek(self, cursor, limit=None):
+        # Keyset pagination: continue after the row the cursor points to
+        if isinstance(cursor, str):
+            cursor = decode_cursor(cursor)
+        self._cursor = cursor
+
+        if limit is not None:
+            self._limit = None, limit
+        return self
+
+    def next_cursor(self, row):
+        names = []
+        for order in self._get_orders():
+            for name, value in self._fields.items():
+                if value is order.source or (
+                    isinstance(value, Q) and
+                    isinstance(order.source, Q) and
+                    str(value) == str(order.source)
+                ):
+                    names.append(name)
+                    break
+            else:
+                raise Exception(f'Order value {order.source!r} must be selected to build cursor')
+
+        return encode_cursor([row[name] for name in names])
+
+    def _get_orders(self):
+        if not self._orders:
+            return self._orders
+
+        # Make the ordering total, so keyset pages never skip or repeat rows
+        table = None
+        for order in self._orders:
+            table = getattr(order.source, 'table', None)
+            if table is not None:
+                break
+        else:
+            tables = self.dependencies - set(self._joins)
+            if tables:
+                table = min(tables, key=str)
+
+        if table is None or not hasattr(table, 'id'):
+            return self._orders
+
+        tie_breaker = str(table.id)
+        for order in self._orders:
+            if str(order.source) == tie_breaker:
+                return self._orders
+
+        return [*self._orders, Order(table.id, self._orders[~0].direction)]
+
+    def _get_seek_condition(self):
+        orders = self._get_orders()
+        values = [Q('{}', value) for value in self._cursor]
+
+        if len(values) != len(orders):
+            raise Exception('Cursor does not match the ordering')
+
+        directions = {order.direction for order in orders}
+
+        if len(directions) == 1:
+            operand = '<' if directions == {'DESC'} else '>'
+            parts = ['(']
+            for order in orders:
+                parts.extend((order.source, ', '))
+            parts[~0] = f') {operand} ('
+            for value in values:
+                parts.extend((value, ', '))
+            parts[~0] = ')'
+            return Expression(*parts)
+
+        # Mixed directions can't use a row value comparison:
+        # (a > $1) OR (a = $1 AND b < $2) OR ...
+        condition = None
+        for i, order in enumerate(orders):
+            operand = '<' if order.direction == 'DESC' else '>'
+            term = Expression('(', order.source, f') {operand} ', values[i])
+            for j in range(i - 1, -1, -1):
+                term = (orders[j].source == values[j]) & term
+            condition = term if condition is None else condition | term
+
+        return condition
+
+    def _get_filters(self):
+        if self._cursor is None:
+            return self._filters
+        return [*self._filters, self._get_seek_condition()]
+
     def _compile_values(self, args):
         values = []
 
@@ -45,16 +170,17 @@ class Select(SelectValuesMixin, Q):
             elif isinstance(value, dict):
                 values.append(f'{self._json_build_object_recursive(value, args)} "{name}"')
             else:
-                values.append(f'{{}} "{name}"')
-                args.append(value)
+                values.append(f'{placeholder(args, value)} "{name}"')
 
         return ', '.join(values)
 
     def _compile_dependencies(self):
+        # Sorted so that the same query always renders to the same text,
+        # whatever the hash order of the dependencies set is
         dependencies = []
         for table in self.dependencies - set(self._joins):
             dependencies.append(str(table))
-        return ', '.join(dependencies)
+        return ', '.join(sorted(dependencies))
 
     def _compile_join(self, args):
         joins = []
@@ -65,9 +191,15 @@ class Select(SelectValuesMixin, Q):
                 )
         return joins
 
+    def _compile_prefetch(self, args):
+        return [
+            f'LEFT JOIN LATERAL ({relation.compile(args)}) "{relation.alias}" ON TRUE'
+            for relation in self._prefetches.values()
+        ]
+
     def _compile_filters(self, args):
         filters = []
-        for condition in self._filters:
+        for condition in self._get_filters():
             if isinstance(condition, Q):
                 filters.append(condition.compile(args))
         return ' AND '.join(filters)
@@ -79,17 +211,18 @@ class Select(SelectValuesMixin, Q):
                 groups.append(value.compile(args))
         return ', '.join(groups)
 
+    def _compile_order_by(self, args):
+        return ', '.join(order.compile(args) for order in self._get_orders())
+
     def _compile_limits(self, args):
         limits = []
 
         offset, limit = self._limit
         if offset is not None:
-            args.append(offset)
-            limits.append('OFFSET {}')
+            limits.append(f'OFFSET {placeholder(args, offset)}')
 
         if limit is not None:
-            args.append(limit)
-            limits.append('LIMIT {}')
+            limits.append(f'LIMIT {placeholder(args, limit)}')
 
         return limits
 
@@ -100,6 +233,7 @@ class Select(SelectValuesMixin, Q):
         sql.append('FROM')
         sql.append(self._compile_dependencies())
         sql.extend(self._compile_join(args))
+        sql.extend(self._compile_prefetch(args))
 
         filters = self._compile_filters(args)
         if filters:
@@ -111,13 +245,56 @@ class Select(SelectValuesMixin, Q):
             sql.append('GROUP BY')
             sql.append(groups)
 
-        # TODO: Order by
+        orders = self._compile_order_by(args)
+        if orders:
+            sql.append('ORDER BY')
+            sql.append(orders)
+
         # TODO: Having
 
         sql.extend(self._compile_limits(args))
 
         return ' '.join(sql)
 
+    def collect(self, shape, args):
+        shape.append(Select)
+        self._collect_recursive(self._fields, shape, args)
+
+        shape.append(frozenset(self.dependencies.difference(self._joins)))
+
+        for table, (mode, condition) in self._joins.items():
+            if isinstance(condition, Q):
+                shape.append(mode)
+                shape.append(table)
+                condition.collect(shape, args)
+        shape.append(None)
+
+        for name, relation in self._prefetches.items():
+            shape.append(name)
+            relation.collect(shape, args)
+        shape.append(None)
+
+        for condition in self._get_filters():
+            if isinstance(condition, Q):
+                condition.collect(shape, args)
+        shape.append(None)
+
+        for value in self._groups:
+            if isinstance(value, Q):
+                value.collect(shape, args)
+        shape.append(None)
+
+        for order in self._get_orders():
+            order.collect(shape, args)
+        shape.append(None)
+
+        offset, limit = self._limit
+        shape.append((offset is None, limit is None))
+        if offset is not None:
+            args.append(offset)
+        if limit is not None:
+            args.append(limit)
+
     def __getitem__(self, val):
         if isinstance(val, slice):
             self._limit = val.start, val.stop
@@ -128,20 +305,50 @@ class Select(SelectValuesMixin, Q):
     # Finalize methods
 
     def __iter__(self):
+        profiler = profile.profiler
+        if profiler is not None:
+            start = perf_counter()
+
         args = []
-        yield self.compile(args).format(*(
-            f'${i}' for i in range(1, len(args) + 1)
-        ))
+        shape = []
+        self.collect(shape, args)
+        shape = tuple(shape)
+
+        sql = statements.get(shape)
+        cache_hit = sql is not None
+        if not cache_hit:
+            args = []
+            sql = self.compile(args)
+            statements.set(shape, sql)
+
+        if profiler is not None:
+            profiler.record(sql, perf_counter() - start, len(args), cache_hit)
+
+        yield sql
         yield from args
 
+    def prepare(self):
+        sql, *args = self
+        return Template(sql, args)
+
+    def _with_limit(self, sql, limit):
+        if self._limit != (None, None):
+            # Keep the query's own limits, cap its result instead
+            sql = f'SELECT 1 FROM ({sql}) s'
+        return f'{sql} LIMIT {limit}'
+
     def exists(self):
-        iterator = iter(self)
-        yield f'SELECT 1 FROM ({next(iterator)})'
-        yield from iterator
+        # Stops at the first row instead of scanning the whole result
+        sql, *args = self
+        yield f'SELECT EXISTS({self._with_limit(sql, 1)})'
+        yield from args
+
+    def _compile_json(self, sql):
+        return f'''SELECT JSON_AGG(ROW_TO_JSON) FROM (SELECT ROW_TO_JSON(s) FROM ({sql}) s) s'''
 
     def as_json(self):
         iterator = iter(self)
-        yield f'''SELECT JSON_AGG(ROW_TO_JSON) FROM (SELECT ROW_TO_JSON(s) FROM ({next(iterator)}) s) s'''
+        yield self._compile_json(next(iterator))
         yield from iterator
 
     def as_list(self):
@@ -149,7 +356,128 @@ class Select(SelectValuesMixin, Q):
         yield f'SELECT ARRAY({next(iterator)})'
         yield from iterator
 
-    def count(self):
+    def count(self, cap=None):
+        # With a cap, counting stops at cap + 1 rows, enough to show "cap+"
+        sql, *args = self
+        if cap is not None:
+            sql = self._with_limit(sql, placeholder(args, cap + 1))
+        yield f'SELECT COUNT(1) FROM ({sql}) s'
+        yield from args
+
+    def explain(self):
         iterator = iter(self)
-        yield f'SELECT COUNT(1) FROM ({next(iterator)})'
+        yield f'EXPLAIN (FORMAT JSON) {next(iterator)}'
         yield from iterator
+
+    # Execution
+
+    def cached(self, ttl=None):
+        self._cached = True
+        self._ttl = ttl
+        return self
+
+    def _get_tables(self):
+        # Every table the statement reads, subqueries included
+        tables = {*self.dependencies, *self._joins}
+
+        expressions = [
+            *self._get_filters(),
+            *(condition for _, condition in self._joins.values()),
+            *self._get_orders(),
+            *self._groups,
+        ]
+        for expression in expressions:
+            if isinstance(expression, Q):
+                tables.update(_get_expression_tables(expression))
+
+        for relation in self._prefetches.values():
+            tables.update(relation._get_tables())
+        return tables
+
+    async def _run(self, method, pool, timeout):
+        pool = executor.get_pool(pool)
+        cache = results.cache
+        if not self._cached or cache is None:
+            return await getattr(pool, method)(self, timeout=timeout)
+
+        statement = tuple(self)
+        return await cache.fetch(
+            method, statement, self._get_tables(),
+            lambda: getattr(pool, method)(statement, timeout=timeout),
+            self._ttl,
+        )
+
+    async def fetch(self, pool=None, timeout=None):
+        return await self._run('fetch', pool, timeout)
+
+    async def fetchval(self, pool=None, timeout=None):
+        return await self._run('fetchval', pool, timeout)
+
+    async def estimate_count(self, pool=None, timeout=None):
+        # Planner row estimate, no rows are read
+        plan = await executor.get_pool(pool).fetchval(self.explain(), timeout=timeout)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def cursor(self, batch_size=1000, name='select_cursor'):
+        return Cursor(self, batch_size, name)
+
+    async def stream(self, pool=None, timeout=None, batch_size=1000):
+        batches = executor.get_pool(pool).stream(self.cursor(batch_size), timeout=timeout)
+        async with aclosing(batches):
+            async for rows in batches:
+                for row in rows:
+                    yield row
+
+
+def _get_expression_tables(expression):
+    tables = set(expression.dependencies)
+    nodes = expression._walk() if isinstance(expression, Node) else (expression, )
+    for node in nodes:
+        if isinstance(node, Select):
+            # Tables a subquery joins are not in its dependencies
+            tables.update(node._get_tables())
+    return tables
+
+
+class Prefetch(Select):
+    __slots__ = ('table', 'name')
+
+    def __init__(self, table, on, values=None, name=None, order=(), limit=None):
+        if values is None:
+            values = list(table)
+
+        if isinstance(values, dict):
+            super().__init__(**values)
+        else:
+            super().__init__(*values)
+
+        self.table = table
+        self.name = name or table.Meta.alias
+
+        self.filter(on)
+        if order:
+            self.order(*order)
+        if limit is not None:
+            self[:limit]
+
+    @property
+    def alias(self):
+        # Never clashes with the tables of the enclosing query
+        return f'prefetch_{self.name}'
+
+    def _compile_dependencies(self):
+        # Other tables come from the enclosing query
+        return str(self.table)
+
+    def compile(self, args):
+        return (
+            f"SELECT COALESCE(JSON_AGG(ROW_TO_JSON(s)), '[]') \"{self.name}\" "
+            f'FROM ({super().compile(args)}) s'
+        )
+
+    def collect(self, shape, args):
+        shape.append(Prefetch)
+        shape.append(self.table)
+        super().collect(shape, args)
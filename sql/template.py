@@ -0,0 +1,50 @@
+from types import MappingProxyType
+
+
+class Param:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'<param: {self.name}>'
+
+
+class Template:
+
+    def __init__(self, sql, args):
+        positions = {}
+        slots = []
+
+        for i, value in enumerate(args):
+            if isinstance(value, Param):
+                positions.setdefault(value.name, []).append(i + 1)
+                slots.append((i, value.name))
+
+        self._sql = sql
+        self._args = tuple(args)
+        self._slots = tuple(slots)
+        self._positions = MappingProxyType({
+            name: tuple(value) for name, value in positions.items()
+        })
+
+    def __repr__(self):
+        return f'<template: {self._sql}>'
+
+    @property
+    def sql(self):
+        return self._sql
+
+    @property
+    def params(self):
+        return self._positions
+
+    def bind(self, **params):
+        args = list(self._args)
+        try:
+            for i, name in self._slots:
+                args[i] = params[name]
+        except KeyError as e:
+            raise Exception(f'Missing value for param {e.args[0]}')
+
+        return (self._sql, *args)
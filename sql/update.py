@@ -0,0 +1,137 @@
+from sql.query import Q, placeholder
+from sql.mixins import WriteMixin
+
+# Alias of the UNNEST subquery in bulk mode
+BULK_ALIAS = 'v'
+
+
+class Update(WriteMixin):
+
+    def __init__(self, table, **values):
+        self.table = table
+
+        self._values = {}
+        self._sources = []
+        self._filters = []
+        self._returning = {}
+        self._bulk = None
+
+        self.set(**values)
+
+    def set(self, **values):
+        for column, value in values.items():
+            self._values[self._get_field(column)[1].name] = value
+        return self
+
+    def from_(self, *tables):
+        # FROM lists exactly these tables, never ones inferred from filters
+        self._sources.extend(tables)
+        return self
+
+    def filter(self, *conditions):
+        self._filters.extend(conditions)
+        return self
+
+    def bulk(self, rows, columns=None, key='id'):
+        # One statement for any number of rows with different values:
+        # each column is bound as a single array and joined back on `key`
+        key = self._get_field(key)
+
+        if columns is None:
+            columns = [
+                (name, field)
+                for name, field in self.table.Meta.fields.items()
+                if name != key[0]
+            ]
+        else:
+            columns = [self._get_field(column) for column in columns]
+            columns = [column for column in columns if column[0] != key[0]]
+
+        self._bulk = rows, [key, *columns]
+        return self
+
+    def _compile_values(self, args):
+        values = []
+
+        if self._bulk is not None:
+            _, (_, *columns) = self._bulk
+            for _, field in columns:
+                if field.name not in self._values:
+                    values.append(f'"{field.name}" = "{BULK_ALIAS}"."{field.name}"')
+
+        for name, value in self._values.items():
+            if isinstance(value, Q):
+                values.append(f'"{name}" = {value.compile(args)}')
+            else:
+                values.append(f'"{name}" = {placeholder(args, value)}')
+
+        if not values:
+            raise Exception('Nothing to update')
+
+        return ', '.join(values)
+
+    def _compile_bulk(self, args):
+        rows, columns = self._bulk
+        arrays = [[] for _ in columns]
+
+        for row in rows:
+            if isinstance(row, dict):
+                row = [row[name] for name, _ in columns]
+            elif len(row) != len(columns):
+                raise Exception(f'Row {row} does not match columns {columns}')
+
+            for array, value in zip(arrays, row):
+                if isinstance(value, Q):
+                    raise Exception('Expressions are not supported in bulk mode')
+                array.append(value)
+
+        unnest = ', '.join(
+            f'{placeholder(args, array)}::{field.array_type}'
+            for array, (_, field) in zip(arrays, columns)
+        )
+        names = ', '.join(f'"{field.name}"' for _, field in columns)
+
+        return f'(SELECT * FROM UNNEST({unnest})) AS "{BULK_ALIAS}" ({names})'
+
+    def _compile_from(self, args):
+        sources = [str(table) for table in self._sources]
+        if self._bulk is not None:
+            sources.append(self._compile_bulk(args))
+        return ', '.join(sources)
+
+    def _compile_filters(self, args):
+        filters = []
+
+        if self._bulk is not None:
+            _, ((_, key), *_) = self._bulk
+            filters.append(f'{key} = "{BULK_ALIAS}"."{key.name}"')
+
+        for condition in self._filters:
+            if isinstance(condition, Q):
+                filters.append(condition.compile(args))
+
+        return ' AND '.join(filters)
+
+    def compile(self, args):
+        sql = [f'UPDATE {self._compile_table()} SET {self._compile_values(args)}']
+
+        sources = self._compile_from(args)
+        if sources:
+            sql.append('FROM')
+            sql.append(sources)
+
+        filters = self._compile_filters(args)
+        if filters:
+            sql.append('WHERE')
+            sql.append(filters)
+
+        sql.extend(self._compile_returning(args))
+
+        return ' '.join(sql)
+
+    # Finalize methods
+
+    def __iter__(self):
+        args = []
+        yield self.compile(args)
+        yield from args
@@ -0,0 +1,38 @@
+from sql.batch import Batch
+from sql.field import Field
+from sql.model import Model, ModelManager
+from sql.query import Q, inline, renumber
+from sql.select import Select
+
+
+class BatchItem(Model):
+    class Meta:
+        table_name = 'batch_item'
+
+    name = Field()
+    n = Field(column_type='integer')
+
+
+ModelManager.models.discard(BatchItem)
+
+
+def test_renumber_skips_quoted_spans():
+    query = (
+        '''SELECT "col$1", 'it''s $1', E'\\'$1', $tag$ $1 $tag$, $$ $1 $$ '''
+        '''FROM t -- $1\n WHERE a = $1 /* $2 */ AND b = $2'''
+    )
+    assert renumber(query, 3) == query.replace('a = $1', 'a = $4').replace('b = $2', 'b = $5')
+    assert inline(query, ['x', 'y']).endswith('a = x /* $2 */ AND b = y')
+
+
+def test_shared_args():
+    first = Select(BatchItem.id).filter(BatchItem.name == 'a', Q('"$1" = {}', 1))
+    second = Select(BatchItem.id).filter(BatchItem.name == 'b').count()
+    third = Select(BatchItem.id).filter(BatchItem.n > 2)
+
+    sql, *args = Batch(first, second, third)
+
+    assert args == ['a', 1, 'b', 2]
+    assert '"$1" = $2' in sql
+    assert sql.count('$3') == 1 and '$4' in sql
+    assert sql.index('$2') < sql.index('$3') < sql.index('$4')
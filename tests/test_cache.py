@@ -0,0 +1,87 @@
+import threading
+
+from sql.cache import StatementCache, statements
+from sql.field import Field
+from sql.model import Model, ModelManager
+from sql.select import Select
+
+
+class CacheItem(Model):
+    class Meta:
+        table_name = 'cache_item'
+
+    name = Field()
+    n = Field(column_type='integer')
+
+
+ModelManager.models.discard(CacheItem)
+
+
+def test_select_hits_cache():
+    statements.clear()
+
+    def build(name, n):
+        return Select(CacheItem.id, label=name).filter(
+            CacheItem.name == name, CacheItem.n > n
+        ).order(CacheItem.n)[n:]
+
+    sql, *args = build('a', 1)
+    assert args == ['a', 'a', 1, 1]
+    assert statements.stats()['misses'] == 1
+    assert statements.stats()['hits'] == 0
+
+    # Same shape, other values: same text, args re-extracted in placeholder order
+    assert tuple(build('b', 2)) == (sql, 'b', 'b', 2, 2)
+    assert statements.stats()['hits'] == 1
+
+    compiled = []
+    assert build('c', 3).compile(compiled) == sql
+    assert tuple(build('c', 3)) == (sql, *compiled)
+
+    # Another shape is compiled on its own
+    other, *_ = Select(CacheItem.id).filter(CacheItem.name == 'a')
+    assert other != sql
+    assert statements.stats() == {'hits': 2, 'misses': 2, 'size': 2, 'maxsize': statements.maxsize}
+
+
+def test_lru_eviction():
+    cache = StatementCache(maxsize=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+
+    # 'b' is the least recently used
+    cache.set('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2}
+
+    cache.clear()
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 2}
+
+
+def test_disabled():
+    cache = StatementCache(maxsize=0)
+    cache.set('a', 'A')
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_concurrent_get_set():
+    cache = StatementCache(maxsize=8)
+
+    def work(n):
+        for i in range(5000):
+            shape = n, i % 16
+            if cache.get(shape) is None:
+                cache.set(shape, 'SELECT 1')
+
+    threads = [threading.Thread(target=work, args=(n, )) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache) == 8
+    assert cache.hits + cache.misses == 8 * 5000
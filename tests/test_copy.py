@@ -0,0 +1,214 @@
+import io
+import json
+import uuid
+import struct
+import datetime
+
+import pytest
+
+from sql.copy import Copy, BINARY_HEADER
+from sql.field import Field
+from sql.model import Model, ModelManager
+
+
+class CopyItem(Model):
+    class Meta:
+        table_name = 'copy_item'
+
+    name = Field()
+    n = Field(column_type='integer')
+    big = Field(column_type='bigint')
+    f = Field(column_type='double precision')
+    ok = Field(column_type='boolean')
+    tags = Field(column_type='text[]')
+    at = Field(column_type='timestamp')
+    day = Field(column_type='date')
+    u = Field(column_type='uuid')
+    data = Field(column_type='jsonb')
+
+
+ModelManager.models.discard(CopyItem)
+
+ROWS = [
+    {
+        'name': 'tab\there\\back\nline\rcr',
+        'n': 1,
+        'big': 2 ** 40,
+        'f': 1.5,
+        'ok': True,
+        'tags': ['x', 'quote"d', 'back\\slash', None, 'with,comma'],
+        'at': datetime.datetime(2024, 1, 2, 3, 4, 5, 6),
+        'day': datetime.date(1999, 12, 31),
+        'u': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'data': {'k': [1, 'two', None]},
+    },
+    {
+        'name': None,
+        'n': None,
+        'big': -1,
+        'f': -2.25,
+        'ok': False,
+        'tags': [],
+        'at': datetime.datetime(1970, 1, 1),
+        'day': None,
+        'u': None,
+        'data': None,
+    },
+]
+
+COLUMNS = list(ROWS[0])
+
+
+# Reference decoders, following the PostgreSQL COPY format documentation
+
+TEXT_UNESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+def decode_text_field(field):
+    if field == '\\N':
+        return None
+
+    value = []
+    chars = iter(field)
+    for char in chars:
+        if char == '\\':
+            value.append(TEXT_UNESCAPES[next(chars)])
+        else:
+            value.append(char)
+    return ''.join(value)
+
+
+def decode_text_array(value):
+    assert value[0] == '{' and value[~0] == '}'
+
+    items = []
+    i = 1
+    while i < len(value) - 1:
+        if value[i] == '"':
+            item = []
+            i += 1
+            while value[i] != '"':
+                if value[i] == '\\':
+                    i += 1
+                item.append(value[i])
+                i += 1
+            items.append(''.join(item))
+            i += 1
+        else:
+            end = value.find(',', i)
+            end = len(value) - 1 if end == -1 else end
+            item = value[i:end]
+            items.append(None if item == 'NULL' else item)
+            i = end
+        if value[i] == ',':
+            i += 1
+    return items
+
+
+TEXT_DECODERS = {
+    'name': str,
+    'n': int,
+    'big': int,
+    'f': float,
+    'ok': {'t': True, 'f': False}.__getitem__,
+    'tags': decode_text_array,
+    'at': datetime.datetime.fromisoformat,
+    'day': datetime.date.fromisoformat,
+    'u': uuid.UUID,
+    'data': json.loads,
+}
+
+
+def decode_text(data):
+    rows = []
+    for line in data.decode().split('\n')[:~0]:
+        row = {}
+        for name, field in zip(COLUMNS, line.split('\t'), strict=True):
+            value = decode_text_field(field)
+            row[name] = None if value is None else TEXT_DECODERS[name](value)
+        rows.append(row)
+    return rows
+
+
+def decode_jsonb(value):
+    assert value[0] == 1
+    return json.loads(value[1:])
+
+
+BINARY_DECODERS = {
+    'name': bytes.decode,
+    'n': lambda value: struct.unpack('!i', value)[0],
+    'big': lambda value: struct.unpack('!q', value)[0],
+    'f': lambda value: struct.unpack('!d', value)[0],
+    'ok': lambda value: value == b'\x01',
+    'at': lambda value: datetime.datetime(2000, 1, 1) + datetime.timedelta(
+        microseconds=struct.unpack('!q', value)[0]
+    ),
+    'day': lambda value: datetime.date(2000, 1, 1) + datetime.timedelta(
+        days=struct.unpack('!i', value)[0]
+    ),
+    'u': lambda value: uuid.UUID(bytes=value),
+    'data': decode_jsonb,
+}
+
+BINARY_COLUMNS = [name for name in COLUMNS if name in BINARY_DECODERS]
+
+
+def decode_binary(data):
+    fo = io.BytesIO(data)
+    assert fo.read(len(BINARY_HEADER)) == BINARY_HEADER
+
+    rows = []
+    while True:
+        count, = struct.unpack('!h', fo.read(2))
+        if count == -1:
+            break
+        assert count == len(BINARY_COLUMNS)
+
+        row = {}
+        for name in BINARY_COLUMNS:
+            length, = struct.unpack('!i', fo.read(4))
+            row[name] = None if length == -1 else BINARY_DECODERS[name](fo.read(length))
+        rows.append(row)
+
+    assert fo.read() == b''
+    return rows
+
+
+def test_text_round_trip():
+    copy = Copy(CopyItem, ROWS, columns=COLUMNS)
+    assert copy.statement() == (
+        'COPY "copy_item" ("name", "n", "big", "f", "ok", "tags", "at", "day", "u", "data") '
+        'FROM STDIN'
+    )
+    assert decode_text(b''.join(copy)) == ROWS
+
+
+def test_binary_round_trip():
+    rows = [{name: row[name] for name in BINARY_COLUMNS} for row in ROWS]
+
+    copy = Copy(CopyItem, rows, columns=BINARY_COLUMNS, binary=True)
+    assert copy.statement().endswith('FROM STDIN WITH (FORMAT binary)')
+    assert decode_binary(b''.join(copy)) == rows
+
+
+def test_tuple_rows_and_batches():
+    rows = [tuple(row[name] for name in COLUMNS) for row in ROWS * 3]
+    chunks = list(Copy(CopyItem, rows, columns=COLUMNS, batch_size=2))
+
+    assert len(chunks) == 3
+    assert decode_text(b''.join(chunks)) == ROWS * 3
+
+
+@pytest.mark.parametrize('binary', [False, True])
+@pytest.mark.parametrize('row', [('short', ), ('long', 1, 2)])
+def test_row_length_mismatch(binary, row):
+    with pytest.raises(Exception):
+        b''.join(Copy(CopyItem, [row], columns=['name', 'n'], binary=binary))
+
+
+@pytest.mark.parametrize('binary', [False, True])
+@pytest.mark.parametrize('row', [{'name': 'x'}, {'name': 'x', 'n': 1, 'nope': 2}, {'nope': 'x'}])
+def test_dict_row_keys_mismatch(binary, row):
+    with pytest.raises(Exception):
+        b''.join(Copy(CopyItem, [row], columns=['name', 'n'], binary=binary))
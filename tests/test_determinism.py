@@ -0,0 +1,113 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEEDS = ['0', '1', '42', '1234', '987654321']
+
+# Builds queries and a migration whose text depends on set and dict order
+# if anything iterates them unsorted. Models hash by address, so the seed
+# also shifts where they are allocated
+SCRIPT = '''
+import os
+import sys
+import random
+import tempfile
+
+from sql import migration
+from sql.aggs import List
+from sql.field import Field
+from sql.index import Index
+from sql.model import Model
+from sql.select import Select
+
+random.seed(os.environ['PYTHONHASHSEED'])
+padding = []
+
+
+def shift():
+    padding.extend(type(f'P{i}', (), {}) for i in range(random.randrange(64)))
+
+
+shift()
+
+
+class Author(Model):
+    name = Field(index=True)
+    email = Field(unique=True)
+    rating = Field(column_type='integer')
+
+
+shift()
+
+
+class Book(Model):
+    author_id = Field(column_type='integer')
+    title = Field()
+    data = Field(column_type='jsonb')
+
+    class Meta:
+        indexes = (Index('title', 'author_id'), )
+
+
+shift()
+
+
+class Tag(Model):
+    book_id = Field(column_type='integer')
+    label = Field()
+
+
+shift()
+
+
+class Shelf(Model):
+    book_id = Field(column_type='integer')
+
+
+queries = [
+    Select(Author.id, title=Book.title, label=Tag.label, shelf=Shelf.id, other=Book['b'].id),
+    Select(
+        Author.id,
+        profile={'z': Author.name, 'a': Author.email, 'm': {'y': Book.title, 'b': 1}},
+        tags=List(label=Tag.label, id=Tag.id),
+    ).join(Book, Book.author_id == Author.id).join(
+        Tag, Tag.book_id == Book.id
+    ).filter(
+        (Author.rating > 3) | (Book.data['k'] == 'v'),
+        Shelf.book_id == Book.id,
+    ).group(Author.id).order(Author.name.desc()),
+]
+
+for query in queries:
+    print(list(query))
+
+directory = tempfile.mkdtemp()
+os.makedirs(os.path.join(directory, 'migrations'))
+os.chdir(directory)
+migration.create_migrations('migrations')
+
+for name in sorted(os.listdir('migrations')):
+    if name.endswith('.py'):
+        # Only the contents, file names carry a random salt
+        with open(os.path.join('migrations', name)) as fo:
+            sys.stdout.write(fo.read())
+'''
+
+
+def run(seed):
+    return subprocess.run(
+        [sys.executable, '-c', SCRIPT],
+        env=dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=ROOT),
+        capture_output=True, text=True, check=True,
+    ).stdout
+
+
+@pytest.mark.parametrize('seed', SEEDS[1:])
+def test_same_sql_across_hash_seeds(seed):
+    expected = run(SEEDS[0])
+    assert expected
+    assert run(seed) == expected
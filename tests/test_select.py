@@ -0,0 +1,69 @@
+from sql.cache import statements
+from sql.field import Field
+from sql.model import Model, ModelManager
+from sql.query import Q
+from sql.select import Select
+
+
+class SelectAuthor(Model):
+    class Meta:
+        table_name = 'select_author'
+
+    name = Field()
+    rating = Field(column_type='integer')
+
+
+class SelectBook(Model):
+    class Meta:
+        table_name = 'select_book'
+
+    author_id = Field(column_type='integer')
+    title = Field()
+
+
+class SelectReview(Model):
+    class Meta:
+        table_name = 'select_review'
+
+    book_id = Field(column_type='integer')
+    score = Field(column_type='integer')
+
+
+ModelManager.models.difference_update((SelectAuthor, SelectBook, SelectReview))
+
+
+def build(offset=0):
+    return Select(
+        SelectAuthor.id,
+        SelectAuthor.name,
+        total=Q('{} + 1', offset),
+        title=SelectBook.title,
+    ).join(
+        SelectBook, (SelectBook.author_id == SelectAuthor.id) & (SelectBook.title != 'x')
+    ).prefetch(
+        SelectReview, on=(SelectReview.book_id == SelectBook.id) & (SelectReview.score > 2),
+        order=(SelectReview.score.desc(), ), limit=5,
+    ).filter(
+        SelectAuthor.rating > 3 + offset,
+    ).group(
+        SelectAuthor.id, Q('"title" || {}', 'g'),
+    ).order(
+        SelectAuthor.name, Q('"rating" * {}', 20 + offset),
+    ).seek(['a', 7, 11], limit=10)[2 + offset:12 + offset]
+
+
+def test_cache_hit_binds_args_like_compile():
+    statements.clear()
+
+    miss = tuple(build())
+    assert statements.stats()['misses'] == 1
+
+    hit = tuple(build())
+    assert statements.stats()['hits'] == 1
+    assert hit == miss
+
+    # Same shape, other values: the args must follow the placeholders
+    args = []
+    sql = build(1).compile(args)
+    assert tuple(build(1)) == (sql, *args) == (miss[0], *args)
+    assert statements.stats()['hits'] == 2